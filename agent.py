@@ -1,14 +1,55 @@
 """
 Anthropic AI Agent for querying Poster POS API.
 """
+import asyncio
+import functools
 import json
-import requests
+import logging
+import os
+import time
+import httpx
+from collections import OrderedDict
 from datetime import datetime, date, timedelta
 
 from charts import generate_generic_chart
 
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+
+    def _dumps(obj) -> str:
+        """Serialize to a JSON string (orjson is UTF-8, no ASCII escaping)."""
+        return orjson.dumps(obj).decode()
+
+    _dumpb = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj) -> str:
+        """Serialize to a JSON string without ASCII escaping."""
+        return json.dumps(obj, ensure_ascii=False)
+
+    def _dumpb(obj) -> bytes:
+        """Serialize to UTF-8 encoded JSON bytes."""
+        return _dumps(obj).encode()
+
+    _loads = json.loads
+
 POSTER_API_URL = "https://joinposter.com/api"
 
+# Shared connection pool for Poster API calls (keep-alive across tool calls).
+# The transport retries failed connection attempts; see _request_poster for
+# retries on gateway errors.
+_http = httpx.AsyncClient(
+    timeout=15,
+    transport=httpx.AsyncHTTPTransport(
+        retries=2,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=40),
+    ),
+)
+POSTER_RETRIES = 2
+POSTER_RETRY_STATUSES = frozenset({502, 503, 504})
+
 FORMATTING_TELEGRAM = """IMPORTANT - Use Telegram HTML formatting only:
 - <b>bold</b> for emphasis and headers
 - <i>italic</i> for secondary emphasis
@@ -200,19 +241,11 @@ SYSTEM_PROMPT_TEMPLATE = """You are a helpful assistant for a bar/restaurant bus
 You have READ-ONLY access to query the Poster API for sales, products, inventory, expenses, and cash register data.
 You cannot modify any data - only retrieve and analyze it.
 
-Today's date is: {today}
-
-IMPORTANT: You have a maximum of {max_iterations} tool calls for this request. Plan accordingly:
-- Prioritize the most important data first
-- Combine related queries if possible
-- If a request requires more data than you can fetch, answer with what you have and note what's missing
-
 When the user asks questions about the business, use the poster_api tool with the appropriate method name and parameters from the API reference below.
 
 Guidelines:
 - Use appropriate date ranges when querying data (YYYYMMDD format)
-- For "today", use {today_yyyymmdd}
-- For "yesterday", use {yesterday_yyyymmdd}
+- For "today" and "yesterday", use the dates given under "Current context" at the end
 - For "this week", use the last 7 days
 - For "this month", use the first day of the current month to today
 - Summarize data clearly with key metrics and insights
@@ -241,7 +274,21 @@ IMPORTANT - Optimize data requests to avoid running out of context:
 - For detailed breakdowns, request only the fields relevant to the breakdown
 """ + POSTER_API_REFERENCE
 
-TOOLS = [
+# Per-request part of the system prompt. Kept out of SYSTEM_PROMPT_TEMPLATE so
+# the large static prefix (with the API reference) can be prompt-cached.
+SYSTEM_CONTEXT_TEMPLATE = """Current context:
+- Today's date is: {today}
+- "today" is {today_yyyymmdd}
+- "yesterday" is {yesterday_yyyymmdd}
+
+IMPORTANT: You have a maximum of {max_iterations} tool calls for this request. Plan accordingly:
+- Prioritize the most important data first
+- Combine related queries if possible
+- If a request requires more data than you can fetch, answer with what you have and note what's missing
+"""
+
+# Tuples so the shared schemas can't be appended to or reordered per request
+TOOLS = (
     {
         "name": "poster_api",
         "description": "Call any Poster POS API method. Use the API reference in the system prompt to find the right method and parameters.",
@@ -331,7 +378,32 @@ TOOLS = [
             "required": ["html"]
         }
     }
-]
+)
+
+# Telegram can't display render_ui panels
+TELEGRAM_TOOLS = tuple(t for t in TOOLS if t["name"] != "render_ui")
+
+
+# Block type that makes a message of each role depend on the one before it
+_ORPHAN_TYPE = {"user": "tool_result", "assistant": "tool_use"}
+
+
+def _is_orphaned(msg: dict) -> bool:
+    """Check whether a message can't start a history on its own.
+
+    A user message carrying tool_results needs the preceding tool_use, and an
+    assistant tool_use without the user prompt before it is orphaned too.
+    """
+    block_type = _ORPHAN_TYPE.get(msg.get("role"))
+    if block_type is None:
+        return False
+    content = msg.get("content")
+    if type(content) is not list:
+        return False
+    for block in content:
+        if type(block) is dict and block.get("type") == block_type:
+            return True
+    return False
 
 
 def _clean_orphaned_messages(messages: list) -> list:
@@ -339,38 +411,12 @@ def _clean_orphaned_messages(messages: list) -> list:
 
     The API requires that every tool_result has a corresponding tool_use in the
     previous assistant message. This function removes any orphaned messages.
+    Always returns a new list.
     """
-    cleaned = list(messages)
-
-    # Keep removing orphaned messages from the start until we have a valid sequence
-    while cleaned:
-        first_msg = cleaned[0]
-        should_remove = False
-
-        # Check if first message is a user message with tool_results (orphaned)
-        if first_msg.get("role") == "user":
-            content = first_msg.get("content", [])
-            if isinstance(content, list) and any(
-                isinstance(block, dict) and block.get("type") == "tool_result"
-                for block in content
-            ):
-                should_remove = True
-
-        # Check if first message is assistant with tool_use (orphaned without user prompt)
-        elif first_msg.get("role") == "assistant":
-            content = first_msg.get("content", [])
-            if isinstance(content, list) and any(
-                isinstance(block, dict) and block.get("type") == "tool_use"
-                for block in content
-            ):
-                should_remove = True
-
-        if should_remove:
-            cleaned = cleaned[1:]
-        else:
-            break
-
-    return cleaned
+    start = 0
+    while start < len(messages) and _is_orphaned(messages[start]):
+        start += 1
+    return messages[start:]
 
 
 def _compress_history_results(messages: list) -> list:
@@ -400,19 +446,18 @@ def _compress_history_results(messages: list) -> list:
     return compressed
 
 
-def _estimate_chars(messages: list) -> int:
-    """Estimate total character count of messages."""
+def _message_chars(msg: dict) -> int:
+    """Estimate the character count of a single message."""
+    content = msg.get("content", "")
+    if isinstance(content, str):
+        return len(content)
     total = 0
-    for msg in messages:
-        content = msg.get("content", "")
-        if isinstance(content, str):
-            total += len(content)
-        elif isinstance(content, list):
-            for block in content:
-                if isinstance(block, dict):
-                    total += len(str(block.get("content", "")))
-                    total += len(str(block.get("text", "")))
-                    total += len(json.dumps(block.get("input", {}))) if block.get("input") else 0
+    if isinstance(content, list):
+        for block in content:
+            if isinstance(block, dict):
+                total += len(str(block.get("content", "")))
+                total += len(str(block.get("text", "")))
+                total += len(_dumpb(block.get("input", {}))) if block.get("input") else 0
     return total
 
 
@@ -422,26 +467,57 @@ def _trim_history(messages: list, max_messages: int = 10, max_chars: int = 30000
     The API requires that every tool_result has a corresponding tool_use in the
     previous assistant message. Naive trimming can break this pairing.
     """
-    # First compress tool results
-    compressed = _compress_history_results(messages)
-
-    # Trim by message count
-    if len(compressed) > max_messages:
-        compressed = compressed[-max_messages:]
-        compressed = _clean_orphaned_messages(compressed)
-
-    # Trim by character budget — drop oldest messages until under budget
-    while len(compressed) > 2 and _estimate_chars(compressed) > max_chars:
-        compressed = compressed[1:]
-        compressed = _clean_orphaned_messages(compressed)
-
-    return compressed
+    # Trim by message count first, so only the retained window is compressed
+    # (compression keeps block types, so orphan checks are unaffected)
+    start = max(len(messages) - max_messages, 0)
+    if start:
+        while start < len(messages) and _is_orphaned(messages[start]):
+            start += 1
+    compressed = _compress_history_results(messages[start:] if start else messages)
+
+    # Trim by character budget — drop oldest messages until under budget.
+    # Each message is measured once and evictions only advance an index.
+    sizes = [_message_chars(msg) for msg in compressed]
+    total = sum(sizes)
+    start = 0
+    while len(compressed) - start > 2 and total > max_chars:
+        total -= sizes[start]
+        start += 1
+        # Drop any tool messages orphaned by the eviction
+        while start < len(compressed) and _is_orphaned(compressed[start]):
+            total -= sizes[start]
+            start += 1
+
+    return compressed[start:] if start else compressed
 
 
 # Timestamp fields that need timezone correction
-TIMESTAMP_FIELDS = {'date_close_date', 'date', 'date_start', 'date_end'}
+TIMESTAMP_FIELDS = frozenset({'date_close_date', 'date', 'date_start', 'date_end'})
 TIMESTAMP_OFFSET_HOURS = 4  # Poster API returns timestamps 4 hours behind local time
 
+# Poster methods whose responses contain TIMESTAMP_FIELDS (per the API
+# reference above); other responses are passed through without a walk
+METHODS_WITH_TIMESTAMPS = frozenset({
+    "dash.getTransactions",
+    "dash.getTransactionHistory",
+    "finance.getCashShifts",
+    "finance.getTransactions",
+    "storage.getSupplies",
+    "storage.getManufactures",
+    "storage.getWastes",
+})
+
+# "HH" -> "HH" + offset, for hours that don't roll over into the next day
+_HOUR_SHIFT = {
+    f"{h:02d}": f"{h + TIMESTAMP_OFFSET_HOURS:02d}"
+    for h in range(24 - TIMESTAMP_OFFSET_HOURS)
+}
+
+# Memo of adjusted timestamps; responses repeat the same values (shift
+# starts, supply dates...) many times over
+_TS_CACHE: dict[str, str] = {}
+_TS_CACHE_SIZE = 8192
+
 
 def _adjust_timestamp(value: str) -> str:
     """Add timezone offset to a timestamp string.
@@ -452,98 +528,125 @@ def _adjust_timestamp(value: str) -> str:
     Returns:
         Adjusted timestamp string
     """
+    cached = _TS_CACHE.get(value)
+    if cached is not None:
+        return cached
     try:
-        dt = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
-        dt = dt + timedelta(hours=TIMESTAMP_OFFSET_HOURS)
-        return dt.strftime('%Y-%m-%d %H:%M:%S')
+        # Fast path: if the shifted hour stays on the same day only the hour
+        # digits change, so validate the fields and splice the new hour in
+        shifted = _HOUR_SHIFT.get(value[11:13]) if len(value) == 19 else None
+        if (shifted is not None and value[4] == value[7] == '-' and value[10] == ' '
+                and value[13] == value[16] == ':'):
+            datetime(int(value[:4]), int(value[5:7]), int(value[8:10]),
+                     0, int(value[14:16]), int(value[17:19]))
+            adjusted = f"{value[:11]}{shifted}{value[13:]}"
+        else:
+            dt = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+            dt = dt + timedelta(hours=TIMESTAMP_OFFSET_HOURS)
+            adjusted = dt.strftime('%Y-%m-%d %H:%M:%S')
     except (ValueError, TypeError):
         return value
+    if len(_TS_CACHE) < _TS_CACHE_SIZE:
+        _TS_CACHE[value] = adjusted
+    return adjusted
 
 
 def _adjust_timestamps(data):
-    """Recursively adjust timestamps in API response data.
+    """Adjust timestamps in API response data in place.
+
+    Walks the tree with an explicit stack instead of recursing, so deeply
+    nested menu/storage responses neither rebuild every container nor hit
+    the recursion limit.
 
     Args:
-        data: API response data (list or dict)
+        data: API response data (list or dict), owned by the caller
 
     Returns:
-        Data with adjusted timestamps
+        The same data object, with adjusted timestamps
     """
-    if isinstance(data, list):
-        return [_adjust_timestamps(item) for item in data]
-
-    if isinstance(data, dict):
-        return {
-            k: _adjust_timestamp(v) if k in TIMESTAMP_FIELDS and isinstance(v, str)
-            else _adjust_timestamps(v) if isinstance(v, (dict, list))
-            else v
-            for k, v in data.items()
-        }
-
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for k, v in node.items():
+                if isinstance(v, str):
+                    if k in TIMESTAMP_FIELDS:
+                        node[k] = _adjust_timestamp(v)
+                elif isinstance(v, (dict, list)):
+                    stack.append(v)
+        elif isinstance(node, list):
+            stack.extend(node)
     return data
 
 
-def _filter_fields(data, fields: list[str] | None):
-    """Filter API response fields using dot notation for nested access.
+def _transform(data, fields: list[str] | None, adjust: bool = True):
+    """Adjust timestamps and filter fields in a single pass over API data.
 
-    Supports:
+    Field paths use dot notation for nested access:
       - "sum"                → top-level field
       - "products"           → entire nested array/object
       - "products.product_name" → only product_name from each item in products
 
     Args:
-        data: API response data (list or dict)
+        data: API response data (list or dict); nested values are
+            adjusted in place
         fields: List of field paths to keep, or None for all fields
+        adjust: Whether the data can contain timestamps to adjust
 
     Returns:
-        Filtered data with only requested fields
+        Data with adjusted timestamps and only the requested fields
     """
-    if fields is None:
-        return data
+    if not fields:
+        return _adjust_timestamps(data) if adjust else data
+
+    ts_fields = TIMESTAMP_FIELDS if adjust else ()
+    adjust_tree = _adjust_timestamps if adjust else (lambda v: v)
 
-    # Parse fields into top-level keys and nested sub-filters
+    # Parse fields into top-level keys and nested sub-filters. Key sets are
+    # dicts so that iterating them follows the requested field order.
     # e.g. ["sum", "products.product_name", "products.num"]
-    # → top_level = {"sum"}, nested = {"products": {"product_name", "num"}}
-    top_level = set()
+    # → keep_keys = {"sum", "products"}, nested = {"products": {"product_name", "num"}}
+    keep_keys = {}
     nested = {}
     for f in fields:
-        if '.' in f:
-            parent, child = f.split('.', 1)
-            nested.setdefault(parent, set()).add(child)
-        else:
-            top_level.add(f)
-
-    # All keys we want to keep (both plain top-level and parents of nested)
-    keep_keys = top_level | set(nested.keys())
-
-    def _filter_dict(d):
+        parent, dot, child = f.partition('.')
+        keep_keys[parent] = None
+        if dot:
+            nested.setdefault(parent, {})[child] = None
+
+    def _project_items(items, keep, sub_filters):
+        # Reuse the (caller-owned) list, replacing records with projections
+        for i, item in enumerate(items):
+            items[i] = _project(item, keep, sub_filters) if isinstance(item, dict) else adjust_tree(item)
+        return items
+
+    def _project(d, keep, sub_filters):
         result = {}
-        for k, v in d.items():
-            if k not in keep_keys:
-                continue
-            if k in nested:
-                # Apply sub-filter to nested value
-                sub_fields = nested[k]
-                if isinstance(v, list):
-                    result[k] = [
-                        {sk: sv for sk, sv in item.items() if sk in sub_fields}
-                        if isinstance(item, dict) else item
-                        for item in v
-                    ]
-                elif isinstance(v, dict):
-                    result[k] = {sk: sv for sk, sv in v.items() if sk in sub_fields}
-                else:
-                    result[k] = v
+        if len(keep) * 2 < len(d):
+            # Few fields from a wide record: look them up instead of scanning
+            pairs = ((k, d[k]) for k in keep if k in d)
+        else:
+            pairs = ((k, v) for k, v in d.items() if k in keep)
+        for k, v in pairs:
+            sub_fields = sub_filters.get(k)
+            if sub_fields is not None and isinstance(v, list):
+                # Apply sub-filter to each item of a nested array
+                result[k] = _project_items(v, sub_fields, {})
+            elif sub_fields is not None and isinstance(v, dict):
+                result[k] = _project(v, sub_fields, {})
+            elif isinstance(v, str) and k in ts_fields:
+                result[k] = _adjust_timestamp(v)
+            elif isinstance(v, (dict, list)):
+                result[k] = adjust_tree(v)
             else:
                 result[k] = v
         return result
 
     if isinstance(data, list):
-        return [_filter_dict(item) if isinstance(item, dict) else item
-                for item in data]
+        return _project_items(data, keep_keys, nested)
 
     if isinstance(data, dict):
-        return _filter_dict(data)
+        return _project(data, keep_keys, nested)
 
     return data
 
@@ -560,39 +663,253 @@ def _compress_tool_result(result: str) -> str:
     if len(result) <= MAX_HISTORY_RESULT_CHARS:
         return result
 
-    # Try to parse as JSON and summarize
-    try:
-        data = json.loads(result)
-    except (json.JSONDecodeError, ValueError):
-        return result[:MAX_HISTORY_RESULT_CHARS] + "... (compressed for history)"
+    # Only JSON arrays are worth parsing (to keep a record sample); an object
+    # just keeps its prefix and anything else is plain text
+    first = result[:16].lstrip()[:1]
+    if first == "{":
+        return result[:MAX_HISTORY_RESULT_CHARS] + "..."
+    if first == "[":
+        try:
+            data = _loads(result)
+        except ValueError:
+            data = None
+        if isinstance(data, list):
+            # Keep first 3 records as sample + record count
+            summary = _dumps(data[:3])
+            if len(summary) > MAX_HISTORY_RESULT_CHARS:
+                summary = summary[:MAX_HISTORY_RESULT_CHARS]
+            return f"{summary}\n({len(data)} records total, showing first 3)"
+
+    return result[:MAX_HISTORY_RESULT_CHARS] + "... (compressed for history)"
 
-    if isinstance(data, list):
-        # Keep first 3 records as sample + record count
-        sample = data[:3]
-        summary = json.dumps(sample, ensure_ascii=False)
-        if len(summary) > MAX_HISTORY_RESULT_CHARS:
-            summary = summary[:MAX_HISTORY_RESULT_CHARS]
-        return f"{summary}\n({len(data)} records total, showing first 3)"
 
+def _parse_poster_response(body: bytes):
+    """Decode a Poster API body and unwrap its "response" envelope.
+
+    Args:
+        body: Raw response bytes
+
+    Returns:
+        The "response" payload, or the whole document if it has no envelope
+    """
+    data = _loads(body)
     if isinstance(data, dict):
-        # Keep just the keys and a truncated version
-        summary = json.dumps(data, ensure_ascii=False)
-        if len(summary) > MAX_HISTORY_RESULT_CHARS:
-            summary = summary[:MAX_HISTORY_RESULT_CHARS] + "..."
-        return summary
+        return data.get("response", data)
+    return data
+
+
+# Poster response cache: (method, params) -> (expires_at, raw body)
+# Bodies are kept as bytes and decoded per call, so every caller gets its own
+# tree that timestamp adjustment can safely mutate in place. Expired entries
+# stay until evicted or refreshed, as a fallback when Poster is unreachable.
+RESPONSE_CACHE_SIZE = 256
+
+# Cache TTLs in seconds per method family
+CACHE_TTL_STATIC = int(os.environ.get('CACHE_TTL_STATIC', '3600'))  # menu, spots, accounts...
+CACHE_TTL_LIVE = int(os.environ.get('CACHE_TTL_LIVE', '60'))  # sales, shifts, stock for today
+CACHE_TTL_HISTORICAL = int(os.environ.get('CACHE_TTL_HISTORICAL', '86400'))  # ranges ending before today
+
+# Reference data that rarely changes during the day
+_STATIC_METHOD_PREFIXES = ("menu.", "spots.", "access.", "settings.")
+_STATIC_METHODS = frozenset({
+    "clients.getGroups",
+    "finance.getAccounts",
+    "finance.getCategories",
+    "storage.getSuppliers",
+})
+_response_cache: OrderedDict = OrderedDict()
+_inflight: dict = {}
+
+# Upper bound on a Poster response body we are willing to download and parse
+MAX_RESPONSE_BYTES = 8 * 1024 * 1024
+_RESPONSE_TOO_LARGE = (
+    f"Poster response exceeds {MAX_RESPONSE_BYTES // (1024 * 1024)} MB, "
+    "narrow the date range or filter with params"
+)
+
+
+def _cache_key(method: str, params: dict) -> tuple:
+    """Build a hashable cache key from a method name and its params."""
+    return (method, tuple(sorted((str(k), str(v)) for k, v in params.items())))
 
-    return result[:MAX_HISTORY_RESULT_CHARS] + "... (compressed for history)"
 
+def _cache_ttl(method: str, params: dict) -> int:
+    """Pick a cache TTL for a Poster method call.
 
-# Whitelist of allowed read-only tools
-ALLOWED_TOOLS = {
-    "poster_api",
-    "plot_graph",
-    "render_ui",
+    Reference data is cached longest; data for past business days does not
+    change; anything touching today is kept only briefly.
+    """
+    if method.startswith(_STATIC_METHOD_PREFIXES) or method in _STATIC_METHODS:
+        return CACHE_TTL_STATIC
+    date_to = str(params.get("dateTo") or params.get("date_to") or "").replace("-", "")
+    if len(date_to) == 8 and date_to.isdigit():
+        from app import get_business_date
+        if date_to < get_business_date().strftime('%Y%m%d'):
+            return CACHE_TTL_HISTORICAL
+    return CACHE_TTL_LIVE
+
+
+async def _request_poster(method: str, params: dict, poster_token: str) -> bytes:
+    """GET a Poster method and return the raw response body."""
+    # Append the token as a pair instead of copying params into a new dict
+    query = [*params.items(), ("token", poster_token)]
+    for attempt in range(POSTER_RETRIES + 1):
+        async with _http.stream(
+            "GET",
+            f"{POSTER_API_URL}/{method}",
+            params=query,
+        ) as response:
+            if response.status_code not in POSTER_RETRY_STATUSES or attempt == POSTER_RETRIES:
+                response.raise_for_status()
+                # Stop reading oversized bodies early instead of buffering them whole;
+                # the model only ever sees MAX_RESULT_CHARS of the result anyway
+                if int(response.headers.get("content-length") or 0) > MAX_RESPONSE_BYTES:
+                    raise ValueError(_RESPONSE_TOO_LARGE)
+                body = bytearray()
+                async for chunk in response.aiter_bytes():
+                    body += chunk
+                    if len(body) > MAX_RESPONSE_BYTES:
+                        raise ValueError(_RESPONSE_TOO_LARGE)
+                break
+        # Transient gateway error, GETs are safe to repeat
+        await asyncio.sleep(0.2 * 2 ** attempt)
+    return bytes(body)
+
+
+async def _fetch_poster(method: str, params: dict, poster_token: str) -> tuple[object, bool]:
+    """Fetch a Poster method through the response cache.
+
+    Concurrent identical calls share a single in-flight request. If the
+    request fails and an expired entry is still cached, that is served
+    instead.
+
+    Args:
+        method: Poster API method, e.g. "dash.getTransactions"
+        params: Query params without the token
+        poster_token: Poster POS API token
+
+    Returns:
+        Tuple of (decoded "response" payload, a fresh object the caller may
+        mutate; whether it is stale cached data)
+    """
+    key = _cache_key(method, params)
+    entry = _response_cache.get(key)
+    if entry is not None and entry[0] > time.monotonic():
+        _response_cache.move_to_end(key)
+        return _parse_poster_response(entry[1]), False
+
+    pending = _inflight.get(key)
+    if pending is None:
+        pending = asyncio.ensure_future(_request_poster(method, params, poster_token))
+        _inflight[key] = pending
+        pending.add_done_callback(lambda _: _inflight.pop(key, None))
+    # Shield so one cancelled caller doesn't cancel the request for the others
+    try:
+        body = await asyncio.shield(pending)
+    except httpx.HTTPError as e:
+        if entry is None:
+            raise
+        logger.warning(f"Poster {method} failed ({e}), serving stale cached response")
+        return _parse_poster_response(entry[1]), True
+    result = _parse_poster_response(body)
+
+    # Don't cache Poster-level errors (e.g. bad params), only real data.
+    # Callers sharing an in-flight request all land here; store it once.
+    current = _response_cache.get(key)
+    if ((current is None or current[0] <= time.monotonic())
+            and not (isinstance(result, dict) and "error" in result)):
+        _response_cache[key] = (time.monotonic() + _cache_ttl(method, params), body)
+        _response_cache.move_to_end(key)
+        if len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+    return result, False
+
+
+async def _handle_render_ui(tool_input: dict, poster_token: str):
+    """Pass render_ui HTML through to the dashboard."""
+    html = tool_input.get("html", "")
+    title = tool_input.get("title", "")
+    if not html:
+        return _dumps({"error": "Missing required 'html' parameter"})
+    return ("render_ui", {"html": html, "title": title})
+
+
+async def _handle_plot_graph(tool_input: dict, poster_token: str):
+    """Generate a chart image from the data supplied by the model."""
+    # Rendering is CPU-bound; keep it off the event loop. The chart is drawn
+    # on its own Figure, so several plot_graph calls can render in parallel.
+    chart_buf = await asyncio.to_thread(
+        generate_generic_chart,
+        chart_type=tool_input.get("chart_type", "bar"),
+        labels=tool_input.get("labels", []),
+        data=tool_input.get("data"),
+        series=tool_input.get("series"),
+        title=tool_input.get("title"),
+        x_label=tool_input.get("x_label"),
+        y_label=tool_input.get("y_label")
+    )
+
+    if chart_buf:
+        return ("Chart generated successfully.", chart_buf)
+    return _dumps({"error": "Failed to generate chart. Charts may not be available."})
+
+
+async def _handle_poster_api(tool_input: dict, poster_token: str) -> str:
+    """Call a read-only Poster API method and format the result for the model."""
+    method = tool_input.get("method")
+    if not method:
+        return _dumps({"error": "Missing required 'method' parameter"})
+    # Drop nulls like requests did; httpx would send them as empty values
+    params = {k: v for k, v in (tool_input.get("params") or {}).items() if v is not None}
+    result, stale = await _fetch_poster(method, params, poster_token)
+
+    # Correct timestamps for the Poster API timezone offset and apply any
+    # field filtering in one pass
+    result = _transform(result, tool_input.get("fields"), method in METHODS_WITH_TIMESTAMPS)
+
+    # Limit response size to avoid token bloat
+    MAX_RESULT_CHARS = 15000
+    if isinstance(result, list):
+        # Encode record by record and stop at the budget, so lists are cut at
+        # record boundaries with each record serialized exactly once
+        parts = []
+        total_len = 1  # "[" + "]", minus the comma the first record doesn't need
+        for item in result:
+            item_buf = _dumpb(item)
+            if total_len + len(item_buf) + 1 > MAX_RESULT_CHARS:
+                break
+            parts.append(item_buf)
+            total_len += len(item_buf) + 1
+        result_str = (b"[" + b",".join(parts) + b"]").decode()
+        if len(parts) < len(result):
+            result_str += f"\n(showing {len(parts)} of {len(result)} records, use 'fields' param to reduce size)"
+    else:
+        buf = _dumpb(result)
+        if len(buf) <= MAX_RESULT_CHARS:
+            result_str = buf.decode()
+        else:
+            # Cut at the last field separator within the budget so the model
+            # doesn't see a half value; fall back to a raw byte cut, dropping
+            # any partial multi-byte character at the end
+            cut = buf.rfind(b",", 0, MAX_RESULT_CHARS)
+            if cut <= 0:
+                cut = MAX_RESULT_CHARS
+            result_str = buf[:cut].decode("utf-8", "ignore") + "... (truncated)"
+
+    if stale:
+        result_str += "\n(stale: Poster API unreachable, this is older cached data and may be out of date)"
+    return result_str
+
+
+# Whitelist of allowed read-only tools, mapped to their handlers
+_TOOL_HANDLERS = {
+    "poster_api": _handle_poster_api,
+    "plot_graph": _handle_plot_graph,
+    "render_ui": _handle_render_ui,
 }
 
 
-def execute_tool(tool_name: str, tool_input: dict, poster_token: str) -> str | tuple[str, object]:
+async def execute_tool(tool_name: str, tool_input: dict, poster_token: str) -> str | tuple[str, object]:
     """Execute a tool call.
 
     For API tools: strictly read-only (HTTP GET only).
@@ -603,92 +920,120 @@ def execute_tool(tool_name: str, tool_input: dict, poster_token: str) -> str | t
         tuple[str, BytesIO]: (result text, chart buffer) for plot_graph
     """
     # Safety check: only allow whitelisted tools
-    if tool_name not in ALLOWED_TOOLS:
-        return json.dumps({"error": f"Tool not allowed: {tool_name}"})
+    handler = _TOOL_HANDLERS.get(tool_name)
+    if handler is None:
+        return _dumps({"error": f"Tool not allowed: {tool_name}"})
 
     try:
-        # Handle render_ui tool — pass through HTML content
-        if tool_name == "render_ui":
-            html = tool_input.get("html", "")
-            title = tool_input.get("title", "")
-            if not html:
-                return json.dumps({"error": "Missing required 'html' parameter"})
-            return ("render_ui", {"html": html, "title": title})
-
-        # Handle plot_graph tool separately
-        if tool_name == "plot_graph":
-            chart_type = tool_input.get("chart_type", "bar")
-            labels = tool_input.get("labels", [])
-            data = tool_input.get("data")
-            series = tool_input.get("series")
-            title = tool_input.get("title")
-            x_label = tool_input.get("x_label")
-            y_label = tool_input.get("y_label")
-
-            chart_buf = generate_generic_chart(
-                chart_type=chart_type,
-                labels=labels,
-                data=data,
-                series=series,
-                title=title,
-                x_label=x_label,
-                y_label=y_label
-            )
-
-            if chart_buf:
-                return ("Chart generated successfully.", chart_buf)
-            else:
-                return json.dumps({"error": "Failed to generate chart. Charts may not be available."})
-
-        method = tool_input.get("method")
-        if not method:
-            return json.dumps({"error": "Missing required 'method' parameter"})
-        url = f"{POSTER_API_URL}/{method}"
-        params = dict(tool_input.get("params", {}))
-        params["token"] = poster_token
-
-        response = requests.get(url, params=params, timeout=15)
-        response.raise_for_status()
-        data = response.json()
-
-        # Return the response data
-        result = data.get("response", data)
-
-        # Adjust timestamps to correct for Poster API timezone offset
-        result = _adjust_timestamps(result)
-
-        # Apply field filtering if specified
-        fields = tool_input.get("fields")
-        if fields:
-            result = _filter_fields(result, fields)
-
-        # Limit response size to avoid token bloat
-        MAX_RESULT_CHARS = 15000
-        if isinstance(result, list) and len(json.dumps(result, ensure_ascii=False)) > MAX_RESULT_CHARS:
-            # Truncate list at record boundaries instead of mid-JSON
-            truncated = []
-            total_len = 2  # for []
-            for item in result:
-                item_str = json.dumps(item, ensure_ascii=False)
-                if total_len + len(item_str) + 2 > MAX_RESULT_CHARS:
-                    break
-                truncated.append(item)
-                total_len += len(item_str) + 2
-            result_str = json.dumps(truncated, ensure_ascii=False)
-            result_str += f"\n(showing {len(truncated)} of {len(result)} records, use 'fields' param to reduce size)"
-        else:
-            result_str = json.dumps(result, ensure_ascii=False)
-            if len(result_str) > MAX_RESULT_CHARS:
-                result_str = result_str[:MAX_RESULT_CHARS] + "... (truncated)"
-        return result_str
+        return await handler(tool_input, poster_token)
+    except httpx.HTTPError as e:
+        return _dumps({"error": f"API request failed: {str(e)}"})
+    except Exception as e:
+        return _dumps({"error": f"Tool execution failed: {str(e)}"})
+
+
+def _tool_result(tool_use_id: str, content: str) -> dict:
+    """Build a tool_result block; content is already a serialized string."""
+    return {"type": "tool_result", "tool_use_id": tool_use_id, "content": content}
+
 
-    except requests.RequestException as e:
-        return json.dumps({"error": f"API request failed: {str(e)}"})
+def _block_to_dict(block) -> dict:
+    """Convert an SDK content block to the plain dict form used in history.
+
+    History is only ever inspected as dicts (orphan checks, render_ui
+    compression), so blocks are converted once when they are stored.
+    """
+    if block.type == "text":
+        return {"type": "text", "text": block.text}
+    if block.type == "tool_use":
+        return {"type": "tool_use", "id": block.id, "name": block.name, "input": block.input}
+    return block.model_dump(exclude_none=True)
+
+
+def _join_text(content: list) -> str:
+    """Concatenate the text blocks of a model response."""
+    return "".join(block.text for block in content if block.type == "text")
+
+
+@functools.lru_cache(maxsize=2)
+def _static_system_prompt(source: str) -> str:
+    """Render the part of the system prompt that never changes for a source."""
+    formatting = FORMATTING_MARKDOWN if source == "dashboard" else FORMATTING_TELEGRAM
+    system_prompt = SYSTEM_PROMPT_TEMPLATE.format(formatting_instructions=formatting)
+    if source == "dashboard":
+        system_prompt += "\n" + RENDER_UI_INSTRUCTIONS
+    return system_prompt
+
+
+@functools.lru_cache(maxsize=8)
+def _build_system_prompt(today: date, max_iterations: int, source: str) -> list:
+    """Build the system prompt blocks for a business date.
+
+    The static block is marked for prompt caching so the API reference is
+    only processed once per cache lifetime; the small context block carries
+    the date and iteration limit. Cached because it only changes once a day.
+
+    Args:
+        today: Current business date
+        max_iterations: Tool use iteration limit mentioned in the prompt
+        source: "telegram" or "dashboard"
+
+    Returns:
+        List of system text blocks
+    """
+    yesterday = today - timedelta(days=1)
+    context = SYSTEM_CONTEXT_TEMPLATE.format(
+        today=today.strftime('%B %d, %Y'),
+        today_yyyymmdd=today.strftime('%Y%m%d'),
+        yesterday_yyyymmdd=yesterday.strftime('%Y%m%d'),
+        max_iterations=max_iterations,
+    )
+    return [
+        {"type": "text", "text": _static_system_prompt(source), "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": context},
+    ]
+
+
+def _with_cache_breakpoint(messages: list) -> list:
+    """Return messages with a prompt-cache breakpoint on the last block.
+
+    The system block's breakpoint already covers the tools and system
+    prompt; this one lets each follow-up turn of a run read the earlier
+    turns (mostly tool results) from cache. The stored history is left
+    untouched, only the outgoing list is copied.
+    """
+    last = messages[-1]
+    content = last["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}] if content else []
+    if not content or not isinstance(content[-1], dict):
+        return messages
+    marked = {**content[-1], "cache_control": {"type": "ephemeral"}}
+    return [*messages[:-1], {**last, "content": [*content[:-1], marked]}]
+
+
+@functools.lru_cache(maxsize=4)
+def _anthropic_client(api_key: str):
+    """Return a shared AsyncAnthropic client for an API key.
+
+    Reusing the client keeps its connection pool to the API warm across
+    agent runs instead of paying a new TLS handshake per message.
+    """
+    import anthropic
+    return anthropic.AsyncAnthropic(api_key=api_key)
+
+
+async def _report_progress(on_progress, text: str) -> None:
+    """Send a progress update to the caller, never failing the agent run."""
+    if on_progress is None:
+        return
+    try:
+        await on_progress(text)
     except Exception as e:
-        return json.dumps({"error": f"Tool execution failed: {str(e)}"})
+        logger.debug(f"Progress update failed: {e}")
 
 
-async def run_agent(prompt: str, anthropic_api_key: str, poster_token: str, model: str = "claude-sonnet-4-20250514", history: list = None, max_iterations: int = 5, source: str = "telegram") -> tuple[str, list, list, list]:
+async def run_agent(prompt: str, anthropic_api_key: str, poster_token: str, model: str = "claude-sonnet-4-20250514", history: list = None, max_iterations: int = 5, source: str = "telegram", on_progress=None) -> tuple[str, list, list, list]:
     """Run the Anthropic agent with tool calling.
 
     Args:
@@ -698,39 +1043,28 @@ async def run_agent(prompt: str, anthropic_api_key: str, poster_token: str, mode
         model: Model to use
         history: Previous conversation messages for context
         max_iterations: Maximum tool use iterations (default 5)
+        source: "telegram" or "dashboard"
+        on_progress: Optional coroutine function called with short status
+            text while tools run and before the final summary
 
     Returns:
         Tuple of (response_text, trimmed_history, charts, render_panels)
         where charts is a list of BytesIO buffers containing generated chart images
         and render_panels is a list of {html, title} dicts for dashboard rendering
     """
-    import anthropic
-
-    client = anthropic.Anthropic(api_key=anthropic_api_key)
+    client = _anthropic_client(anthropic_api_key)
 
     # Build system prompt with current date and iteration limit
     from app import get_business_date
-    today = get_business_date()
-    yesterday = today - timedelta(days=1)
-    formatting = FORMATTING_MARKDOWN if source == "dashboard" else FORMATTING_TELEGRAM
-    system_prompt = SYSTEM_PROMPT_TEMPLATE.format(
-        today=today.strftime('%B %d, %Y'),
-        today_yyyymmdd=today.strftime('%Y%m%d'),
-        yesterday_yyyymmdd=yesterday.strftime('%Y%m%d'),
-        max_iterations=max_iterations,
-        formatting_instructions=formatting
-    )
+    system_prompt = _build_system_prompt(get_business_date(), max_iterations, source)
 
-    # Add render_ui instructions and tool for dashboard only
-    if source == "dashboard":
-        system_prompt += "\n" + RENDER_UI_INSTRUCTIONS
-        tools = TOOLS  # includes render_ui
-    else:
-        tools = [t for t in TOOLS if t["name"] != "render_ui"]
+    # render_ui is only offered on the dashboard
+    tools = TOOLS if source == "dashboard" else TELEGRAM_TOOLS
 
     # Start with history (if provided) + new user message
     # Validate incoming history to remove any orphaned tool_use/tool_result pairs
-    messages = _clean_orphaned_messages(list(history)) if history else []
+    # (_clean_orphaned_messages returns a new list, so history isn't mutated)
+    messages = _clean_orphaned_messages(history) if history else []
     messages.append({"role": "user", "content": prompt})
 
     iteration = 0
@@ -740,68 +1074,75 @@ async def run_agent(prompt: str, anthropic_api_key: str, poster_token: str, mode
     while iteration < max_iterations:
         iteration += 1
 
-        response = client.messages.create(
-            model=model,
-            max_tokens=8192 if source == "dashboard" else 2048,
-            system=system_prompt,
-            tools=tools,
-            messages=messages
-        )
-
-        import logging
-        _agent_logger = logging.getLogger(__name__)
-        _agent_logger.info(f"Agent iteration {iteration}: stop_reason={response.stop_reason}, content_types={[b.type for b in response.content]}")
+        # Stream the turn and start each tool call as soon as its block is
+        # complete, so Poster requests overlap the rest of the generation
+        pending = {}
+        try:
+            async with client.messages.stream(
+                model=model,
+                max_tokens=8192 if source == "dashboard" else 2048,
+                system=system_prompt,
+                tools=tools,
+                messages=_with_cache_breakpoint(messages)
+            ) as stream:
+                async for event in stream:
+                    if event.type == "content_block_stop" and event.content_block.type == "tool_use":
+                        block = event.content_block
+                        pending[block.id] = asyncio.ensure_future(
+                            execute_tool(block.name, block.input, poster_token)
+                        )
+                response = await stream.get_final_message()
+        except BaseException:
+            for task in pending.values():
+                task.cancel()
+            raise
+
+        logger.info(f"Agent iteration {iteration}: stop_reason={response.stop_reason}, content_types={[b.type for b in response.content]}")
 
         # Check if we need to handle tool calls
         if response.stop_reason == "tool_use":
             # Process all tool calls
             tool_results = []
-            assistant_content = response.content
-
-            for block in response.content:
-                if block.type == "tool_use":
-                    tool_result = execute_tool(
-                        block.name,
-                        block.input,
-                        poster_token
-                    )
-
-                    # Handle tuple results (chart or render_ui)
-                    if isinstance(tool_result, tuple):
-                        result_text, payload = tool_result
-                        if result_text == "render_ui":
-                            # render_ui returns ("render_ui", {html, title})
-                            render_panels.append(payload)
-                            tool_results.append({
-                                "type": "tool_result",
-                                "tool_use_id": block.id,
-                                "content": "Content rendered in the dashboard panel."
-                            })
-                        else:
-                            # plot_graph returns (text, BytesIO)
-                            charts.append(payload)
-                            tool_results.append({
-                                "type": "tool_result",
-                                "tool_use_id": block.id,
-                                "content": result_text
-                            })
+            assistant_content = [_block_to_dict(block) for block in response.content]
+
+            # Run all tool calls of this turn concurrently; results keep block order
+            tool_blocks = [block for block in response.content if block.type == "tool_use"]
+            await _report_progress(on_progress, f"🔎 Fetching data (step {iteration}/{max_iterations})...")
+            outcomes = await asyncio.gather(*(
+                pending.get(block.id) or execute_tool(block.name, block.input, poster_token)
+                for block in tool_blocks
+            ), return_exceptions=True)
+
+            for block, tool_result in zip(tool_blocks, outcomes):
+                # Every tool_use needs a tool_result, even if its call blew up
+                if isinstance(tool_result, Exception):
+                    tool_result = _dumps({"error": f"Tool execution failed: {str(tool_result)}"})
+
+                # Handle tuple results (chart or render_ui)
+                if isinstance(tool_result, tuple):
+                    result_text, payload = tool_result
+                    if result_text == "render_ui":
+                        # render_ui returns ("render_ui", {html, title})
+                        render_panels.append(payload)
+                        tool_results.append(_tool_result(block.id, "Content rendered in the dashboard panel."))
                     else:
-                        tool_results.append({
-                            "type": "tool_result",
-                            "tool_use_id": block.id,
-                            "content": tool_result
-                        })
+                        # plot_graph returns (text, BytesIO)
+                        charts.append(payload)
+                        tool_results.append(_tool_result(block.id, result_text))
+                else:
+                    tool_results.append(_tool_result(block.id, tool_result))
 
             # Add assistant response and tool results to messages
             messages.append({"role": "assistant", "content": assistant_content})
             messages.append({"role": "user", "content": tool_results})
 
         else:
+            # Tool calls started before the turn ended without tool_use
+            for task in pending.values():
+                task.cancel()
+
             # No more tool calls, extract final text response
-            final_text = ""
-            for block in response.content:
-                if hasattr(block, "text"):
-                    final_text += block.text
+            final_text = _join_text(response.content)
 
             # Add assistant response to messages for history
             messages.append({"role": "assistant", "content": final_text})
@@ -815,18 +1156,16 @@ async def run_agent(prompt: str, anthropic_api_key: str, poster_token: str, mode
         "content": "You've reached the maximum number of tool calls. Please summarize what you've found so far based on the data you've already retrieved. If you couldn't complete the request, explain what information is missing."
     })
 
+    await _report_progress(on_progress, "📝 Summarizing findings...")
     try:
-        summary_response = client.messages.create(
+        summary_response = await client.messages.create(
             model=model,
             max_tokens=1024,
             system=system_prompt,
             messages=messages
         )
 
-        summary_text = ""
-        for block in summary_response.content:
-            if hasattr(block, "text"):
-                summary_text += block.text
+        summary_text = _join_text(summary_response.content)
 
         if summary_text:
             messages.append({"role": "assistant", "content": summary_text})
@@ -4,12 +4,25 @@ import json
 import logging
 import asyncio
 import functools
+import heapq
+import html
+import random
 import sys
+import threading
+import time
 import argparse
 import tempfile
+from collections import OrderedDict, defaultdict
 from datetime import datetime, date, timedelta
 import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Import chart functions
 from charts import (
@@ -77,8 +90,8 @@ POSTER_API_URL = "https://joinposter.com/api"
 # Import config module
 import config
 from config import (
-    CONFIG_FILE, load_config, save_config, mask_api_key,
-    set_api_key, delete_api_key, get_config_data,
+    CONFIG_FILE, API_KEY_VARS, load_config, save_config_soon, flush_config, mask_api_key,
+    set_api_key, delete_api_key, get_config_snapshot,
     subscribed_chats, theft_alert_chats, admin_chat_ids,
     approved_users, pending_requests, last_alerted_transaction_id, last_alerted_expense_id,
     notified_transaction_ids, notified_transaction_date, last_seen_void_id, last_cash_balance,
@@ -101,8 +114,6 @@ THAI_TZ = pytz.timezone('Asia/Bangkok')
 # Global scheduler
 scheduler = None
 
-# Async lock to prevent concurrent API operations causing race conditions
-api_lock = asyncio.Lock()
 
 # Request configuration
 REQUEST_TIMEOUT = 30  # seconds
@@ -113,6 +124,42 @@ REQUEST_POOL_TIMEOUT = 10
 MAX_RETRIES = 3
 RETRY_DELAY = 1  # Base delay in seconds for exponential backoff
 
+# Shared HTTP session for Poster and OpenAI calls (reuses TCP/TLS connections).
+# Fetchers also run in dashboard worker threads, so size the pool for that.
+# Connection failures and gateway errors are retried with a short backoff;
+# urllib3 only repeats idempotent methods after a response, so the OpenAI
+# POSTs are retried on connection failures alone.
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=10,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504), raise_on_status=False),
+))
+
+
+
+# Access roles, ordered so that role >= ROLE_APPROVED means "may use the bot"
+ROLE_NONE = 0
+ROLE_PENDING = 1
+ROLE_APPROVED = 2
+ROLE_ADMIN = 3
+
+# require_auth replies for roles below ROLE_APPROVED
+AUTH_DENIED_REPLIES = (
+    "Access required. Send /request to request access.",
+    "Your request is pending approval.",
+)
+
+
+def _user_role(chat_id):
+    """Return the access role (ROLE_*) of a chat ID."""
+    if chat_id in admin_chat_ids:
+        return ROLE_ADMIN
+    if chat_id in approved_users:
+        return ROLE_APPROVED
+    if chat_id in pending_requests:
+        return ROLE_PENDING
+    return ROLE_NONE
 
 
 def require_auth(func):
@@ -123,11 +170,9 @@ def require_auth(func):
         if not admin_chat_ids:
             await update.message.reply_text("No admin configured. Send /setup to become admin.")
             return
-        if chat_id not in admin_chat_ids and chat_id not in approved_users:
-            if chat_id in pending_requests:
-                await update.message.reply_text("Your request is pending approval.")
-            else:
-                await update.message.reply_text("Access required. Send /request to request access.")
+        role = _user_role(chat_id)
+        if role < ROLE_APPROVED:
+            await update.message.reply_text(AUTH_DENIED_REPLIES[role])
             return
         user = update.effective_user
         username = f"@{user.username}" if user and user.username else f"id:{chat_id}"
@@ -156,43 +201,61 @@ def require_admin(func):
     return wrapper
 
 
-async def clear_webhook():
-    """Clear any existing webhook before starting polling."""
+# Bot shared by scheduled jobs and notification paths. startup() points it at
+# the application's bot; get_bot() creates one on first use otherwise (CLI).
+_bot = None
+
+
+def get_bot():
+    """Return the shared Telegram Bot instead of building a client per call."""
+    global _bot
+    if _bot is None:
+        _bot = Bot(token=TELEGRAM_BOT_TOKEN)
+    return _bot
+
+
+async def clear_webhook(bot):
+    """Clear any existing webhook before starting polling.
+
+    Args:
+        bot: The application's Bot, reused rather than opening a new client
+    """
+    # deleteWebhook is idempotent, so skip the get_webhook_info round trip.
+    # Dropping pending updates matches run_polling(drop_pending_updates=True).
     try:
-        bot = Bot(token=TELEGRAM_BOT_TOKEN)
-        webhook_info = await bot.get_webhook_info()
-        if webhook_info.url:
-            logger.info(f"Clearing existing webhook: {webhook_info.url}")
-            await bot.delete_webhook(drop_pending_updates=True)
-            logger.info("Webhook cleared successfully")
-        else:
-            logger.info("No webhook configured")
+        await bot.delete_webhook(drop_pending_updates=True)
+        logger.info("Webhook cleared")
     except Exception as e:
         logger.warning(f"Failed to clear webhook: {e}")
 
 
+def _backoff_delay(attempt):
+    """Exponential backoff with jitter, so concurrent retries don't fire in lockstep."""
+    return RETRY_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
 async def retry_async(coro_func, *args, max_retries=MAX_RETRIES, **kwargs):
-    """Retry an async operation with exponential backoff."""
+    """Retry an async operation with exponential backoff.
+
+    Calls are not serialized: Telegram accepts concurrent requests, and its
+    rate limit is honoured through RetryAfter below.
+    """
     last_exception = None
 
     for attempt in range(max_retries):
         try:
-            async with api_lock:
-                return await coro_func(*args, **kwargs)
+            return await coro_func(*args, **kwargs)
         except RetryAfter as e:
             wait_time = e.retry_after + 1
             logger.warning(f"Rate limited, waiting {wait_time}s before retry")
-            await asyncio.sleep(wait_time)
             last_exception = e
         except TimedOut as e:
-            wait_time = RETRY_DELAY * (2 ** attempt)
-            logger.warning(f"Request timed out (attempt {attempt + 1}/{max_retries}), retrying in {wait_time}s")
-            await asyncio.sleep(wait_time)
+            wait_time = _backoff_delay(attempt)
+            logger.warning(f"Request timed out (attempt {attempt + 1}/{max_retries}), retrying in {wait_time:.1f}s")
             last_exception = e
         except NetworkError as e:
-            wait_time = RETRY_DELAY * (2 ** attempt)
-            logger.warning(f"Network error (attempt {attempt + 1}/{max_retries}): {e}, retrying in {wait_time}s")
-            await asyncio.sleep(wait_time)
+            wait_time = _backoff_delay(attempt)
+            logger.warning(f"Network error (attempt {attempt + 1}/{max_retries}): {e}, retrying in {wait_time:.1f}s")
             last_exception = e
         except Conflict as e:
             # Don't retry conflicts - this means another instance is running
@@ -203,6 +266,10 @@ async def retry_async(coro_func, *args, max_retries=MAX_RETRIES, **kwargs):
             logger.error(f"Unexpected error in retry_async: {e}")
             raise
 
+        # No point sleeping after the final attempt
+        if attempt + 1 < max_retries:
+            await asyncio.sleep(wait_time)
+
     # All retries exhausted
     logger.error(f"All {max_retries} retries exhausted")
     if last_exception:
@@ -231,6 +298,21 @@ async def safe_send_message(bot, chat_id, text, parse_mode=None, **kwargs):
         return None
 
 
+async def broadcast_message(bot, chat_ids, text, parse_mode=ParseMode.HTML):
+    """Send the same message to several chats concurrently.
+
+    Returns:
+        List of (chat_id, result) pairs, where result is the sent message,
+        None if the send failed, or the exception raised (e.g. Conflict)
+    """
+    chat_ids = list(chat_ids)
+    results = await asyncio.gather(*(
+        safe_send_message(bot, chat_id, text, parse_mode=parse_mode)
+        for chat_id in chat_ids
+    ), return_exceptions=True)
+    return list(zip(chat_ids, results))
+
+
 # Theft detection thresholds
 LARGE_DISCOUNT_THRESHOLD = 20  # Alert if discount > 20%
 LARGE_REFUND_THRESHOLD = 50000  # Alert if refund > 500 THB (in cents)
@@ -262,6 +344,17 @@ BUSINESS_DAY_CUTOFF_HOUR = 4
 def adjust_poster_time(timestamp_str):
     """Add 4-hour offset to Poster API timestamp (API returns 4h behind local time)."""
     try:
+        # Unless the shift crosses midnight only the hour digits change, so
+        # validate the fields and splice the new hour in without strptime
+        ts = timestamp_str
+        if (len(ts) == 19 and ts[4] == ts[7] == '-' and ts[10] == ' '
+                and ts[13] == ts[16] == ':' and ts[11:13].isdigit()):
+            hour = int(ts[11:13]) + 4
+            if hour < 24:
+                datetime(int(ts[:4]), int(ts[5:7]), int(ts[8:10]),
+                         hour, int(ts[14:16]), int(ts[17:19]))
+                return f"{ts[:11]}{hour:02d}{ts[13:]}"
+
         dt = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
         dt = dt + timedelta(hours=4)
         return dt.strftime('%Y-%m-%d %H:%M:%S')
@@ -281,38 +374,83 @@ def get_business_date():
     return now.date()
 
 
-def fetch_cash_shifts():
-    """Fetch cash shift data from Poster API."""
-    url = f"{POSTER_API_URL}/finance.getCashShifts"
-    params = {"token": config.POSTER_ACCESS_TOKEN}
+# Poster response cache for report fetchers: (method, params) -> (expires_at, body).
+# Bodies are kept as raw bytes and decoded per call, so callers never share
+# (and can't corrupt) each other's data. Fetchers run in worker threads.
+POSTER_CACHE_SIZE = 128
+POSTER_CACHE_TTL_LIVE = 30  # ranges that include today's business day
+POSTER_CACHE_TTL_HISTORICAL = 3600  # ranges ending before today
+_poster_cache = OrderedDict()
+_poster_cache_lock = threading.Lock()
+
+
+def _poster_cache_ttl(params):
+    """Pick how long a cached response for these params stays fresh."""
+    date_to = str(params.get("dateTo") or "").replace("-", "")
+    if len(date_to) == 8 and date_to < get_business_date().strftime('%Y%m%d'):
+        return POSTER_CACHE_TTL_HISTORICAL
+    return POSTER_CACHE_TTL_LIVE
+
+
+def _poster_get(method, what, params=None, timeout=10, cache=False, fresh=False):
+    """Call a Poster API method over the shared session.
+
+    Args:
+        method: Poster API method, e.g. "dash.getTransactions"
+        what: Description used in the error log ("Failed to fetch <what>")
+        params: Query parameters; the access token is added automatically
+        timeout: Request timeout in seconds
+        cache: Serve and store successful responses in the response cache
+        fresh: With cache, skip the lookup but still store the new response
+
+    Returns:
+        The "response" payload, or [] if the request failed
+    """
+    params = params or {}
+    key = (method, tuple(sorted(params.items())))
+    if cache and not fresh:
+        with _poster_cache_lock:
+            entry = _poster_cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                _poster_cache.move_to_end(key)
+                return json.loads(entry[1]).get("response", [])
 
     try:
-        response = requests.get(url, params=params, timeout=10)
+        response = http_session.get(
+            f"{POSTER_API_URL}/{method}",
+            params={"token": config.POSTER_ACCESS_TOKEN, **params},
+            timeout=timeout,
+        )
         response.raise_for_status()
         data = response.json()
-        return data.get("response", [])
     except requests.RequestException as e:
-        logger.error(f"Failed to fetch cash shifts: {e}")
+        logger.error(f"Failed to fetch {what}: {e}")
         return []
 
+    # Only cache real data, not Poster-level errors (bad token, bad params)
+    if cache and "error" not in data:
+        with _poster_cache_lock:
+            _poster_cache[key] = (time.monotonic() + _poster_cache_ttl(params), response.content)
+            _poster_cache.move_to_end(key)
+            if len(_poster_cache) > POSTER_CACHE_SIZE:
+                _poster_cache.popitem(last=False)
+    return data.get("response", [])
+
+
+def fetch_cash_shifts():
+    """Fetch cash shift data from Poster API."""
+    return _poster_get("finance.getCashShifts", "cash shifts")
+
 
-def fetch_finance_transactions(date_from, date_to=None):
-    """Fetch finance transactions (expenses/income) from Poster API."""
-    url = f"{POSTER_API_URL}/finance.getTransactions"
-    params = {
-        "token": config.POSTER_ACCESS_TOKEN,
+def fetch_finance_transactions(date_from, date_to=None, fresh=False):
+    """Fetch finance transactions (expenses/income) from Poster API.
+
+    Responses are cached briefly; pass fresh=True to bypass the cache.
+    """
+    return _poster_get("finance.getTransactions", "finance transactions", {
         "dateFrom": date_from,
         "dateTo": date_to or date_from
-    }
-
-    try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("response", [])
-    except requests.RequestException as e:
-        logger.error(f"Failed to fetch finance transactions: {e}")
-        return []
+    }, cache=True, fresh=fresh)
 
 
 def calculate_expenses(finance_transactions):
@@ -353,42 +491,23 @@ def calculate_expenses(finance_transactions):
     }
 
 
-def fetch_transactions(date_from, date_to=None):
-    """Fetch transactions for a date or date range from Poster API."""
-    url = f"{POSTER_API_URL}/dash.getTransactions"
-    params = {
-        "token": config.POSTER_ACCESS_TOKEN,
+def fetch_transactions(date_from, date_to=None, fresh=False):
+    """Fetch transactions for a date or date range from Poster API.
+
+    Responses are cached briefly; pass fresh=True to bypass the cache.
+    """
+    return _poster_get("dash.getTransactions", "transactions", {
         "dateFrom": date_from,
         "dateTo": date_to or date_from
-    }
-
-    try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("response", [])
-    except requests.RequestException as e:
-        logger.error(f"Failed to fetch transactions: {e}")
-        return []
+    }, cache=True, fresh=fresh)
 
 
 def fetch_product_sales(date_from, date_to=None):
     """Fetch product-level sales data from Poster API."""
-    url = f"{POSTER_API_URL}/dash.getProductsSales"
-    params = {
-        "token": config.POSTER_ACCESS_TOKEN,
+    return _poster_get("dash.getProductsSales", "product sales", {
         "dateFrom": date_from,
         "dateTo": date_to or date_from
-    }
-
-    try:
-        response = requests.get(url, params=params, timeout=15)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("response", [])
-    except requests.RequestException as e:
-        logger.error(f"Failed to fetch product sales: {e}")
-        return []
+    }, timeout=15)
 
 
 def fetch_product_catalog():
@@ -396,88 +515,36 @@ def fetch_product_catalog():
 
     Returns a dict mapping product_id (str) -> category_name (str).
     """
-    url = f"{POSTER_API_URL}/menu.getProducts"
-    params = {"token": config.POSTER_ACCESS_TOKEN}
-
-    try:
-        response = requests.get(url, params=params, timeout=15)
-        response.raise_for_status()
-        data = response.json()
-        products = data.get("response", [])
-        return {
-            str(p.get("product_id", "")): p.get("category_name", "Uncategorized") or "Uncategorized"
-            for p in products
-        }
-    except requests.RequestException as e:
-        logger.error(f"Failed to fetch product catalog: {e}")
-        return {}
+    products = _poster_get("menu.getProducts", "product catalog", timeout=15)
+    return {
+        str(p.get("product_id", "")): p.get("category_name", "Uncategorized") or "Uncategorized"
+        for p in products
+    }
 
 
 def fetch_stock_levels():
     """Fetch current stock/inventory levels from Poster API."""
-    url = f"{POSTER_API_URL}/storage.getStorageLeftovers"
-    params = {"token": config.POSTER_ACCESS_TOKEN}
-
-    try:
-        response = requests.get(url, params=params, timeout=15)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("response", [])
-    except requests.RequestException as e:
-        logger.error(f"Failed to fetch stock levels: {e}")
-        return []
+    return _poster_get("storage.getStorageLeftovers", "stock levels", timeout=15)
 
 
 def fetch_transaction_products(transaction_id):
     """Fetch products for a specific transaction from Poster API."""
-    url = f"{POSTER_API_URL}/dash.getTransactionProducts"
-    params = {
-        "token": config.POSTER_ACCESS_TOKEN,
+    return _poster_get("dash.getTransactionProducts", "transaction products", {
         "transaction_id": transaction_id
-    }
-
-    try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("response", [])
-    except requests.RequestException as e:
-        logger.error(f"Failed to fetch transaction products: {e}")
-        return []
+    })
 
 
 def fetch_ingredient_usage(date_from, date_to=None):
     """Fetch ingredient usage/movement from Poster API."""
-    url = f"{POSTER_API_URL}/storage.getReportMovement"
-    params = {
-        "token": config.POSTER_ACCESS_TOKEN,
+    return _poster_get("storage.getReportMovement", "ingredient usage", {
         "dateFrom": date_from,
         "dateTo": date_to or date_from
-    }
-
-    try:
-        response = requests.get(url, params=params, timeout=15)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("response", [])
-    except requests.RequestException as e:
-        logger.error(f"Failed to fetch ingredient usage: {e}")
-        return []
+    }, timeout=15)
 
 
 def fetch_clients():
     """Fetch all customers from Poster marketing/CRM."""
-    url = f"{POSTER_API_URL}/clients.getClients"
-    params = {"token": config.POSTER_ACCESS_TOKEN}
-
-    try:
-        response = requests.get(url, params=params, timeout=15)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("response", [])
-    except requests.RequestException as e:
-        logger.error(f"Failed to fetch clients: {e}")
-        return []
+    return _poster_get("clients.getClients", "clients", timeout=15)
 
 
 def calculate_summary(transactions):
@@ -487,11 +554,22 @@ def calculate_summary(transactions):
     cash_sales = 0
     card_sales = 0
 
+    if not transactions:
+        return {
+            "transaction_count": 0,
+            "total_sales": 0,
+            "total_profit": 0,
+            "cash_sales": 0,
+            "card_sales": 0
+        }
+
     for txn in transactions:
-        total_sales += int(txn.get('sum', 0) or 0)
-        total_profit += int(txn.get('total_profit', 0) or 0)
-        cash_sales += int(txn.get('payed_cash', 0) or 0)
-        card_sales += int(txn.get('payed_card', 0) or 0)
+        # Bind the row's get once; missing and empty values count as 0
+        get = txn.get
+        total_sales += int(get('sum') or 0)
+        total_profit += int(get('total_profit') or 0)
+        cash_sales += int(get('payed_cash') or 0)
+        card_sales += int(get('payed_card') or 0)
 
     return {
         "transaction_count": len(transactions),
@@ -527,94 +605,88 @@ def format_summary_message(date_display, summary, expenses=None):
     return message
 
 
+# /start and /help replies; all static, so they are built once at import
+START_NO_ADMIN_HTML = (
+    "🍺 <b>Ban Sabai POS Bot</b>\n\n"
+    "No admin configured.\n"
+    "Send /setup to become admin."
+)
+
+START_PENDING_HTML = (
+    "🍺 <b>Ban Sabai POS Bot</b>\n\n"
+    "Your access request is pending approval.\n"
+    "Please wait for admin to approve."
+)
+
+START_ACCESS_REQUIRED_HTML = (
+    "🍺 <b>Ban Sabai POS Bot</b>\n\n"
+    "Access required.\n"
+    "Send /request to request access."
+)
+
+_MENU_COMMANDS_HTML = (
+    "🍺 <b>Ban Sabai POS Bot</b>\n\n"
+    "<b>📊 Reports:</b>\n"
+    "/today - Today's sales summary\n"
+    "/week - This week's summary\n"
+    "/month - This month's summary\n"
+    "/summary DATE [DATE] - Custom date/range\n"
+    "/sales [N] - Last N sales with items\n"
+    "/products [today|week|month] - Product sales\n"
+    "/stats [today|week|month] - Sales statistics\n"
+    "/expenses [DATE] [DATE] - Expense breakdown\n\n"
+    "<b>📦 Inventory:</b>\n"
+    "/stock - Current stock levels\n"
+    "/ingredients [today|week|month] - Ingredient usage\n\n"
+    "<b>💵 Cash:</b>\n"
+    "/cash - Cash register balance\n\n"
+    "<b>🔔 Real-time:</b>\n"
+    "/subscribe - Get notified on each sale\n"
+    "/unsubscribe - Stop sale notifications\n\n"
+    "<b>🚨 Security:</b>\n"
+    "/alerts - Enable theft detection\n"
+    "/alerts_off - Disable theft alerts\n\n"
+    "<b>🤖 AI Assistant:</b>\n"
+    "/agent &lt;question&gt; - Ask AI about your data\n\n"
+    "<b>📊 Dashboard:</b>\n"
+    "/dashboard - Open web dashboard\n"
+    "/setpassword &lt;pw&gt; - Set dashboard password\n"
+    "/setgoal &lt;THB&gt; - Set monthly profit goal\n\n"
+)
+
+_ADMIN_COMMANDS_HTML = (
+    "<b>👑 Admin:</b>\n"
+    "/approve - Approve user access\n"
+    "/reject ID - Reject user request\n"
+    "/users - List approved users\n"
+    "/promote ID - Promote user to admin\n"
+    "/demote ID - Remove admin privileges\n"
+    "/removeuser ID - Remove a user\n"
+    "/config - View bot configuration\n"
+    "/reset - Reset all configuration\n\n"
+    "<b>🔧 Debug:</b>\n"
+    "/debug - Show raw transaction data\n"
+    "/resend - Resend last 2 notifications\n"
+    "/loglevel [LEVEL] - Set logging level\n\n"
+)
+
+MENU_USER_HTML = _MENU_COMMANDS_HTML + "/help - Show this message"
+MENU_ADMIN_HTML = _MENU_COMMANDS_HTML + _ADMIN_COMMANDS_HTML + "/help - Show this message"
+
+# /start reply for each access role, indexed by ROLE_*
+START_REPLIES_HTML = (START_ACCESS_REQUIRED_HTML, START_PENDING_HTML, MENU_USER_HTML, MENU_ADMIN_HTML)
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /start command."""
     chat_id = str(update.effective_chat.id)
 
     # No admin configured yet
     if not admin_chat_ids:
-        await update.message.reply_text(
-            "🍺 <b>Ban Sabai POS Bot</b>\n\n"
-            "No admin configured.\n"
-            "Send /setup to become admin.",
-            parse_mode=ParseMode.HTML
-        )
-        return
-
-    # Check if user is approved
-    is_admin = chat_id in admin_chat_ids
-    is_approved = chat_id in approved_users
-    is_pending = chat_id in pending_requests
-
-    if not is_admin and not is_approved:
-        if is_pending:
-            await update.message.reply_text(
-                "🍺 <b>Ban Sabai POS Bot</b>\n\n"
-                "Your access request is pending approval.\n"
-                "Please wait for admin to approve.",
-                parse_mode=ParseMode.HTML
-            )
-        else:
-            await update.message.reply_text(
-                "🍺 <b>Ban Sabai POS Bot</b>\n\n"
-                "Access required.\n"
-                "Send /request to request access.",
-                parse_mode=ParseMode.HTML
-            )
+        await update.message.reply_text(START_NO_ADMIN_HTML, parse_mode=ParseMode.HTML)
         return
 
-    # User has access - show full menu
-    message = (
-        "🍺 <b>Ban Sabai POS Bot</b>\n\n"
-        "<b>📊 Reports:</b>\n"
-        "/today - Today's sales summary\n"
-        "/week - This week's summary\n"
-        "/month - This month's summary\n"
-        "/summary DATE [DATE] - Custom date/range\n"
-        "/sales [N] - Last N sales with items\n"
-        "/products [today|week|month] - Product sales\n"
-        "/stats [today|week|month] - Sales statistics\n"
-        "/expenses [DATE] [DATE] - Expense breakdown\n\n"
-        "<b>📦 Inventory:</b>\n"
-        "/stock - Current stock levels\n"
-        "/ingredients [today|week|month] - Ingredient usage\n\n"
-        "<b>💵 Cash:</b>\n"
-        "/cash - Cash register balance\n\n"
-        "<b>🔔 Real-time:</b>\n"
-        "/subscribe - Get notified on each sale\n"
-        "/unsubscribe - Stop sale notifications\n\n"
-        "<b>🚨 Security:</b>\n"
-        "/alerts - Enable theft detection\n"
-        "/alerts_off - Disable theft alerts\n\n"
-        "<b>🤖 AI Assistant:</b>\n"
-        "/agent &lt;question&gt; - Ask AI about your data\n\n"
-        "<b>📊 Dashboard:</b>\n"
-        "/dashboard - Open web dashboard\n"
-        "/setpassword &lt;pw&gt; - Set dashboard password\n"
-        "/setgoal &lt;THB&gt; - Set monthly profit goal\n\n"
-    )
-
-    # Add admin commands if user is admin
-    if is_admin:
-        message += (
-            "<b>👑 Admin:</b>\n"
-            "/approve - Approve user access\n"
-            "/reject ID - Reject user request\n"
-            "/users - List approved users\n"
-            "/promote ID - Promote user to admin\n"
-            "/demote ID - Remove admin privileges\n"
-            "/removeuser ID - Remove a user\n"
-            "/config - View bot configuration\n"
-            "/reset - Reset all configuration\n\n"
-            "<b>🔧 Debug:</b>\n"
-            "/debug - Show raw transaction data\n"
-            "/resend - Resend last 2 notifications\n"
-            "/loglevel [LEVEL] - Set logging level\n\n"
-        )
-
-    message += "/help - Show this message"
-
-    await update.message.reply_text(message, parse_mode=ParseMode.HTML)
+    await update.message.reply_text(START_REPLIES_HTML[_user_role(chat_id)], parse_mode=ParseMode.HTML)
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -642,7 +714,7 @@ async def setup(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         'username': user.username if user else None,
         'approved_at': datetime.now().isoformat()
     }
-    save_config()
+    save_config_soon()
 
     await update.message.reply_text(
         "✅ <b>Admin Setup Complete!</b>\n\n"
@@ -682,7 +754,7 @@ async def request_access(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         'username': user.username if user else None,
         'requested_at': datetime.now().isoformat()
     }
-    save_config()
+    save_config_soon()
 
     await update.message.reply_text(
         "📤 <b>Access Requested!</b>\n\n"
@@ -694,21 +766,25 @@ async def request_access(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # Notify all admins
     if TELEGRAM_BOT_TOKEN and admin_chat_ids:
         try:
-            bot = Bot(token=TELEGRAM_BOT_TOKEN)
+            bot = context.bot
             username_str = f"@{user.username}" if user and user.username else "No username"
-            for admin_id in admin_chat_ids:
-                await safe_send_message(
-                    bot, admin_id,
-                    (
-                        f"🔔 <b>New Access Request</b>\n\n"
-                        f"<b>Name:</b> {user.full_name if user else 'Unknown'}\n"
-                        f"<b>Username:</b> {username_str}\n"
-                        f"<b>Chat ID:</b> <code>{chat_id}</code>\n\n"
-                        f"Use /approve {chat_id} to approve\n"
-                        f"Use /reject {chat_id} to reject"
-                    ),
-                    parse_mode=ParseMode.HTML
-                )
+            admin_message = (
+                f"🔔 <b>New Access Request</b>\n\n"
+                f"<b>Name:</b> {user.full_name if user else 'Unknown'}\n"
+                f"<b>Username:</b> {username_str}\n"
+                f"<b>Chat ID:</b> <code>{chat_id}</code>\n\n"
+                f"Use /approve {chat_id} to approve\n"
+                f"Use /reject {chat_id} to reject"
+            )
+            # Send to all admins concurrently rather than one round-trip at a time
+            admin_ids = list(admin_chat_ids)
+            results = await asyncio.gather(*(
+                safe_send_message(bot, admin_id, admin_message, parse_mode=ParseMode.HTML)
+                for admin_id in admin_ids
+            ), return_exceptions=True)
+            for admin_id, result in zip(admin_ids, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Failed to notify admin {admin_id} of access request: {result}")
         except Exception as e:
             logger.error(f"Failed to notify admins of access request: {e}")
 
@@ -754,7 +830,7 @@ async def approve(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         'username': user_info.get('username'),
         'approved_at': datetime.now().isoformat()
     }
-    save_config()
+    save_config_soon()
 
     await update.message.reply_text(
         f"✅ <b>User Approved</b>\n\n"
@@ -765,7 +841,7 @@ async def approve(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Notify the user
     if TELEGRAM_BOT_TOKEN:
         try:
-            bot = Bot(token=TELEGRAM_BOT_TOKEN)
+            bot = context.bot
             await safe_send_message(
                 bot, target_chat_id,
                 (
@@ -803,7 +879,7 @@ async def reject(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     # Remove from pending
     user_info = pending_requests.pop(target_chat_id)
-    save_config()
+    save_config_soon()
 
     await update.message.reply_text(
         f"❌ <b>Request Rejected</b>\n\n"
@@ -814,7 +890,7 @@ async def reject(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Notify the user
     if TELEGRAM_BOT_TOKEN:
         try:
-            bot = Bot(token=TELEGRAM_BOT_TOKEN)
+            bot = context.bot
             await safe_send_message(
                 bot, target_chat_id,
                 "❌ Your access request has been denied.",
@@ -890,7 +966,7 @@ async def promote(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     # Promote the user
     admin_chat_ids.add(target_chat_id)
-    save_config()
+    save_config_soon()
 
     user_info = approved_users[target_chat_id]
     await update.message.reply_text(
@@ -902,7 +978,7 @@ async def promote(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Notify the new admin
     if TELEGRAM_BOT_TOKEN:
         try:
-            bot = Bot(token=TELEGRAM_BOT_TOKEN)
+            bot = context.bot
             await safe_send_message(
                 bot, target_chat_id,
                 (
@@ -962,7 +1038,7 @@ async def demote(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     # Demote the user
     admin_chat_ids.discard(target_chat_id)
-    save_config()
+    save_config_soon()
 
     user_info = approved_users.get(target_chat_id, {'name': 'Unknown'})
     await update.message.reply_text(
@@ -974,7 +1050,7 @@ async def demote(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Notify the demoted user
     if TELEGRAM_BOT_TOKEN:
         try:
-            bot = Bot(token=TELEGRAM_BOT_TOKEN)
+            bot = context.bot
             await safe_send_message(
                 bot, target_chat_id,
                 "ℹ️ Your admin privileges have been removed.",
@@ -1033,7 +1109,7 @@ async def removeuser(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     admin_chat_ids.discard(target_chat_id)
     subscribed_chats.discard(target_chat_id)
     theft_alert_chats.discard(target_chat_id)
-    save_config()
+    save_config_soon()
 
     await update.message.reply_text(
         f"🚫 <b>User Removed</b>\n\n"
@@ -1045,7 +1121,7 @@ async def removeuser(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     # Notify the removed user
     if TELEGRAM_BOT_TOKEN:
         try:
-            bot = Bot(token=TELEGRAM_BOT_TOKEN)
+            bot = context.bot
             await safe_send_message(
                 bot, target_chat_id,
                 "ℹ️ Your access has been revoked by an admin. Send /request to request access again.",
@@ -1060,18 +1136,16 @@ async def removeuser(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 @require_admin
 async def config_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /config command - show or set configuration."""
-    allowed_vars = ["ANTHROPIC_API_KEY", "OPENAI_API_KEY", "ELEVENLABS_API_KEY", "POSTER_ACCESS_TOKEN"]
-
     # Handle /config set <VAR> <VALUE>
     if context.args and len(context.args) >= 3 and context.args[0].lower() == "set":
         var_name = context.args[1].upper()
         var_value = " ".join(context.args[2:])
 
-        if var_name not in allowed_vars:
+        if var_name not in API_KEY_VARS:
             await update.message.reply_text(
                 f"Unknown variable: {var_name}\n\n"
                 f"Allowed variables:\n"
-                + "\n".join(f"• {v}" for v in allowed_vars)
+                + "\n".join(f"• {v}" for v in API_KEY_VARS)
             )
             return
 
@@ -1088,11 +1162,11 @@ async def config_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     if context.args and len(context.args) >= 2 and context.args[0].lower() == "del":
         var_name = context.args[1].upper()
 
-        if var_name not in allowed_vars:
+        if var_name not in API_KEY_VARS:
             await update.message.reply_text(
                 f"Unknown variable: {var_name}\n\n"
                 f"Allowed variables:\n"
-                + "\n".join(f"• {v}" for v in allowed_vars)
+                + "\n".join(f"• {v}" for v in API_KEY_VARS)
             )
             return
 
@@ -1109,68 +1183,65 @@ async def config_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         return
 
     try:
-        config_data = get_config_data()
-        if not config_data:
+        if not os.path.exists(CONFIG_FILE):
             await update.message.reply_text("No configuration file exists yet.")
             return
+        # Render from the loaded state rather than re-reading the file
+        config_data = get_config_snapshot()
 
-        # Format the config nicely
-        message = "⚙️ <b>Bot Configuration</b>\n\n"
+        # Format the config nicely; collect lines and join once at the end
+        lines = ["⚙️ <b>Bot Configuration</b>", ""]
 
         # API Keys section
-        message += "<b>API Keys:</b>\n"
-        for key_name, cfg_attr in [
-            ('ANTHROPIC_API_KEY', config.ANTHROPIC_API_KEY),
-            ('OPENAI_API_KEY', config.OPENAI_API_KEY),
-            ('ELEVENLABS_API_KEY', config.ELEVENLABS_API_KEY),
-            ('POSTER_ACCESS_TOKEN', config.POSTER_ACCESS_TOKEN),
-        ]:
-            key_val = config_data.get(key_name) or cfg_attr
-            message += f"  • {key_name}: <code>{mask_api_key(key_val) if key_val else 'Not set'}</code>\n"
-        message += "\n"
-
-        # Admin info - handle both old and new format
-        admin_ids = set(config_data.get('admin_chat_ids', []))
-        old_admin = config_data.get('admin_chat_id')
-        if old_admin:
-            admin_ids.add(old_admin)
-        message += f"<b>Admins:</b> {len(admin_ids)}\n"
-        for admin_id in admin_ids:
-            message += f"  • <code>{admin_id}</code>\n"
-        message += "\n"
+        lines.append("<b>API Keys:</b>")
+        for key_name in API_KEY_VARS:
+            key_val = config_data.get(key_name)
+            lines.append(f"  • {key_name}: <code>{mask_api_key(key_val) if key_val else 'Not set'}</code>")
+        lines.append("")
+
+        # Admin info; load_config already migrated the old single-admin
+        # format and normalized IDs to str, so use the live set directly
+        admin_ids = admin_chat_ids
+        lines.append(f"<b>Admins:</b> {len(admin_ids)}")
+        lines.extend(f"  • <code>{admin_id}</code>" for admin_id in admin_ids)
+        lines.append("")
 
         # Approved users
         users_data = config_data.get('approved_users', {})
-        message += f"<b>Approved Users:</b> {len(users_data)}\n"
+        lines.append(f"<b>Approved Users:</b> {len(users_data)}")
         for chat_id, info in users_data.items():
             username = f"@{info.get('username')}" if info.get('username') else "no username"
             is_admin = " (Admin)" if chat_id in admin_ids else ""
-            message += f"  • {info.get('name', 'Unknown')}{is_admin} - {username}\n"
+            lines.append(f"  • {info.get('name', 'Unknown')}{is_admin} - {username}")
 
         # Pending requests
         pending = config_data.get('pending_requests', {})
-        message += f"\n<b>Pending Requests:</b> {len(pending)}\n"
+        lines.append("")
+        lines.append(f"<b>Pending Requests:</b> {len(pending)}")
         for chat_id, info in pending.items():
             username = f"@{info.get('username')}" if info.get('username') else "no username"
-            message += f"  • {info.get('name', 'Unknown')} - {username}\n"
+            lines.append(f"  • {info.get('name', 'Unknown')} - {username}")
 
         # Subscribed chats
         subs = config_data.get('subscribed_chats', [])
-        message += f"\n<b>Sale Notifications:</b> {len(subs)} chat(s)\n"
+        lines.append("")
+        lines.append(f"<b>Sale Notifications:</b> {len(subs)} chat(s)")
 
         # Theft alert chats
         alerts = config_data.get('theft_alert_chats', [])
-        message += f"<b>Theft Alerts:</b> {len(alerts)} chat(s)\n"
+        lines.append(f"<b>Theft Alerts:</b> {len(alerts)} chat(s)")
 
         # Config file path and usage hint
-        message += f"\n<i>File: {CONFIG_FILE}</i>\n"
-        message += "<i>Use /config set VAR VALUE to set API keys</i>"
+        lines.append("")
+        lines.append(f"<i>File: {CONFIG_FILE}</i>")
+        lines.append("<i>Use /config set VAR VALUE to set API keys</i>")
+        message = "\n".join(lines)
 
         await update.message.reply_text(message, parse_mode=ParseMode.HTML)
 
         # Send raw JSON as a separate message (with sensitive fields masked)
         display_config = config_data.copy()
-        for key_name in ('ANTHROPIC_API_KEY', 'OPENAI_API_KEY', 'ELEVENLABS_API_KEY', 'POSTER_ACCESS_TOKEN'):
+        for key_name in API_KEY_VARS:
             if display_config.get(key_name):
                 display_config[key_name] = mask_api_key(display_config[key_name])
         # Strip password hashes from approved_users
@@ -1179,12 +1250,21 @@ async def config_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
                 k: {kk: vv for kk, vv in v.items() if kk != 'password_hash'}
                 for k, v in display_config['approved_users'].items()
             }
-        raw_json = json.dumps(display_config, indent=2, ensure_ascii=False)
-        # Telegram message limit is 4096 chars, truncate if needed
-        if len(raw_json) > 4000:
+        # Telegram message limit is 4096 chars, truncate if needed. Encode
+        # lazily and stop once past the limit rather than formatting the
+        # whole config only to throw most of it away.
+        parts = []
+        size = 0
+        for chunk in json.JSONEncoder(indent=2, ensure_ascii=False).iterencode(display_config):
+            parts.append(chunk)
+            size += len(chunk)
+            if size > 4000:
+                break
+        raw_json = "".join(parts)
+        if size > 4000:
             raw_json = raw_json[:4000] + "\n... (truncated)"
         await update.message.reply_text(
-            f"<b>Raw Config:</b>\n<pre>{raw_json}</pre>",
+            f"<b>Raw Config:</b>\n<pre>{html.escape(raw_json, quote=False)}</pre>",
             parse_mode=ParseMode.HTML
         )
 
@@ -1375,7 +1455,8 @@ async def agent(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
         response, updated_history, charts, _panels = await run_agent(
             prompt, config.ANTHROPIC_API_KEY, config.POSTER_ACCESS_TOKEN,
-            history=history, max_iterations=user_limits['max_iterations']
+            history=history, max_iterations=user_limits['max_iterations'],
+            on_progress=thinking_msg.edit_text
         )
 
         # Store updated history (already trimmed to last 10 messages)
@@ -1407,6 +1488,40 @@ async def agent(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await thinking_msg.edit_text(f"Error: {str(e)}")
 
 
+def _openai_transcribe(audio_path):
+    """Transcribe an OGG voice file with OpenAI Whisper (blocking)."""
+    with open(audio_path, "rb") as audio_file:
+        resp = http_session.post(
+            "https://api.openai.com/v1/audio/transcriptions",
+            headers={"Authorization": f"Bearer {config.OPENAI_API_KEY}"},
+            files={"file": ("voice.ogg", audio_file, "audio/ogg")},
+            data={"model": "whisper-1"},
+            timeout=30
+        )
+    resp.raise_for_status()
+    return resp.json().get("text", "").strip()
+
+
+def _openai_speech(text, out_path):
+    """Synthesize text to an MP3 file with OpenAI TTS (blocking)."""
+    resp = http_session.post(
+        "https://api.openai.com/v1/audio/speech",
+        headers={
+            "Authorization": f"Bearer {config.OPENAI_API_KEY}",
+            "Content-Type": "application/json",
+        },
+        json={
+            "model": "tts-1",
+            "input": text,
+            "voice": "onyx",
+        },
+        timeout=30,
+    )
+    resp.raise_for_status()
+    with open(out_path, "wb") as f:
+        f.write(resp.content)
+
+
 @require_admin
 async def voice_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle voice messages - transcribe via OpenAI Whisper API and pass to AI agent."""
@@ -1470,17 +1585,8 @@ async def voice_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         os.close(tmp_fd)
         await voice_file.download_to_drive(tmp_path)
 
-        # Transcribe via OpenAI Whisper API
-        with open(tmp_path, "rb") as audio_file:
-            resp = requests.post(
-                "https://api.openai.com/v1/audio/transcriptions",
-                headers={"Authorization": f"Bearer {config.OPENAI_API_KEY}"},
-                files={"file": ("voice.ogg", audio_file, "audio/ogg")},
-                data={"model": "whisper-1"},
-                timeout=30
-            )
-        resp.raise_for_status()
-        prompt = resp.json().get("text", "").strip()
+        # Transcribe via OpenAI Whisper API, off the event loop
+        prompt = await asyncio.to_thread(_openai_transcribe, tmp_path)
     except Exception as e:
         logger.error(f"Voice transcription error: {e}")
         await status_msg.edit_text(f"Error transcribing voice message: {str(e)}")
@@ -1549,25 +1655,9 @@ async def voice_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
                 if len(tts_text) > 4096:
                     tts_text = tts_text[:4096]
 
-                tts_resp = requests.post(
-                    "https://api.openai.com/v1/audio/speech",
-                    headers={
-                        "Authorization": f"Bearer {config.OPENAI_API_KEY}",
-                        "Content-Type": "application/json",
-                    },
-                    json={
-                        "model": "tts-1",
-                        "input": tts_text,
-                        "voice": "onyx",
-                    },
-                    timeout=30,
-                )
-                tts_resp.raise_for_status()
-
                 tts_fd, tts_path = tempfile.mkstemp(suffix=".mp3")
                 os.close(tts_fd)
-                with open(tts_path, "wb") as f:
-                    f.write(tts_resp.content)
+                await asyncio.to_thread(_openai_speech, tts_text, tts_path)
 
                 with open(tts_path, "rb") as f:
                     await update.message.reply_voice(voice=f)
@@ -1582,6 +1672,26 @@ async def voice_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await status_msg.edit_text(f"Error: {str(e)}")
 
 
+def _latest_transactions(transactions, count, require_sum=False):
+    """Return the newest open/closed transactions, newest first.
+
+    Filters and extracts each integer transaction ID in a single pass, then
+    picks the newest with a bounded heap instead of sorting the whole day.
+
+    Args:
+        transactions: Transactions as returned by fetch_transactions
+        count: How many to return
+        require_sum: Skip transactions without a positive sum (voided)
+    """
+    candidates = [
+        (int(t.get('transaction_id', 0)), t)
+        for t in transactions
+        if str(t.get('status')) in ('1', '2')
+        and (not require_sum or int(t.get('sum', 0) or 0) > 0)
+    ]
+    return [t for _, t in heapq.nlargest(count, candidates, key=lambda pair: pair[0])]
+
+
 @require_admin
 async def debug(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /debug command - show raw API transaction data."""
@@ -1589,23 +1699,24 @@ async def debug(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     await update.message.reply_text("⏳ Fetching raw transaction data...")
 
-    transactions = [t for t in fetch_transactions(today_str)
-                    if str(t.get('status')) in ('1', '2')]
+    # Newest 3 by transaction_id
+    recent = _latest_transactions(await asyncio.to_thread(fetch_transactions, today_str), 3)
 
-    if not transactions:
+    if not recent:
         await update.message.reply_text("No transactions found for today.")
         return
 
-    # Sort by transaction_id descending and take last 3
-    transactions.sort(key=lambda x: int(x.get('transaction_id', 0)), reverse=True)
-    recent = transactions[:3]
-
     message = f"<b>🔍 Debug: Last closed {len(recent)} transactions</b>\n\n"
 
     for txn in recent:
         txn_id = txn.get('transaction_id', 'N/A')
+        if orjson is not None:
+            raw = orjson.dumps(txn, option=orjson.OPT_INDENT_2).decode()
+        else:
+            raw = json.dumps(txn, indent=2, ensure_ascii=False)
+        # Escape after truncating so an entity is never cut in half
         message += f"<b>Transaction ID:</b> {txn_id}\n"
-        message += f"<pre>{json.dumps(txn, indent=2, ensure_ascii=False)[:1000]}</pre>\n\n"
+        message += f"<pre>{html.escape(raw[:1000], quote=False)}</pre>\n\n"
 
     # Also show notified transaction set info
     message += f"<b>notified_transaction_ids:</b> {len(notified_transaction_ids)} tracked\n"
@@ -1625,12 +1736,13 @@ async def sales(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         except ValueError:
             pass
 
-    today_str = get_business_date().strftime('%Y%m%d')
-    today_display = get_business_date().strftime('%d %b %Y')
+    business_date = get_business_date()
+    today_str = business_date.strftime('%Y%m%d')
+    today_display = business_date.strftime('%d %b %Y')
 
     await update.message.reply_text(f"⏳ Fetching last {count} sales...")
 
-    transactions = fetch_transactions(today_str)
+    transactions = await asyncio.to_thread(fetch_transactions, today_str)
 
     if not transactions:
         await update.message.reply_text("No transactions found for today.")
@@ -1677,7 +1789,7 @@ async def sales(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         # Fetch items
         items_str = ""
         try:
-            products = fetch_transaction_products(txn_id)
+            products = await asyncio.to_thread(fetch_transaction_products, txn_id)
             if products:
                 items_list = []
                 for p in products[:5]:  # Limit to 5 items per sale
@@ -1719,28 +1831,24 @@ async def resend(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     await update.message.reply_text(f"⏳ Fetching and resending last {count} transactions...")
 
-    transactions = fetch_transactions(today_str)
+    transactions = await asyncio.to_thread(fetch_transactions, today_str)
 
     if not transactions:
         await update.message.reply_text("No transactions found for today.")
         return
 
-    # Filter for open and closed transactions with actual sales (exclude voided with sum=0)
-    closed_txns = [t for t in transactions if str(t.get('status')) in ('1', '2') and int(t.get('sum', 0) or 0) > 0]
-    closed_txns.sort(key=lambda x: int(x.get('transaction_id', 0)), reverse=True)
+    # Newest open and closed transactions with actual sales (exclude voided with sum=0)
+    recent = _latest_transactions(transactions, count, require_sum=True)
 
-    if not closed_txns:
+    if not recent:
         await update.message.reply_text("No transactions found for today.")
         return
 
-    # Take requested count
-    recent = closed_txns[:count]
-
     if not subscribed_chats:
         await update.message.reply_text("No subscribed chats to send to.")
         return
 
-    bot = Bot(token=TELEGRAM_BOT_TOKEN)
+    bot = get_bot()
     sent_count = 0
 
     for txn in reversed(recent):  # Send oldest first
@@ -1762,7 +1870,7 @@ async def resend(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         # Fetch items sold in this transaction
         items_str = ""
         try:
-            products = fetch_transaction_products(txn_id)
+            products = await asyncio.to_thread(fetch_transaction_products, txn_id)
             if products:
                 items_list = []
                 for p in products:
@@ -1785,13 +1893,11 @@ async def resend(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             f"{items_str}"
         )
 
-        for chat_id in subscribed_chats.copy():
-            try:
-                result = await safe_send_message(bot, chat_id, message, parse_mode=ParseMode.HTML)
-                if result:
-                    sent_count += 1
-            except Exception as e:
-                logger.error(f"Failed to resend to {chat_id}: {e}")
+        for chat_id, result in await broadcast_message(bot, subscribed_chats, message):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to resend to {chat_id}: {result}")
+            elif result:
+                sent_count += 1
 
     await update.message.reply_text(f"✅ Resent {len(recent)} transactions to {len(subscribed_chats)} chats ({sent_count} messages sent).")
 
@@ -1867,7 +1973,7 @@ async def products(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     await update.message.reply_text(f"⏳ Fetching product sales for {period_display}...")
 
-    product_sales = fetch_product_sales(date_from, date_to)
+    product_sales = await asyncio.to_thread(fetch_product_sales, date_from, date_to)
 
     if not product_sales:
         await update.message.reply_text("No product sales found for this period.")
@@ -1911,7 +2017,7 @@ async def products(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     # Generate and send chart
     try:
-        chart = generate_products_chart(product_sales, f"Top Products - {period_display}")
+        chart = await asyncio.to_thread(generate_products_chart, product_sales, f"Top Products - {period_display}")
         if chart:
             await update.message.reply_photo(photo=InputFile(chart, filename='products.png'))
     except Exception as e:
@@ -1961,8 +2067,10 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text(f"⏳ Calculating statistics for {period_display}...")
 
     # Fetch current and previous period data
-    current_sales = fetch_product_sales(current_from, current_to)
-    prev_sales = fetch_product_sales(prev_from, prev_to)
+    current_sales, prev_sales = await asyncio.gather(
+        asyncio.to_thread(fetch_product_sales, current_from, current_to),
+        asyncio.to_thread(fetch_product_sales, prev_from, prev_to),
+    )
 
     if not current_sales:
         await update.message.reply_text("No product sales found for this period.")
@@ -2040,7 +2148,8 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     # Generate and send comparison chart
     try:
-        chart = generate_stats_chart(
+        chart = await asyncio.to_thread(
+            generate_stats_chart,
             current_sales, prev_sales,
             f"Product Comparison - {period_display} vs {prev_display}",
             period_display, prev_display
@@ -2056,7 +2165,7 @@ async def stock(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /stock command - show current inventory levels."""
     await update.message.reply_text("⏳ Fetching stock levels...")
 
-    stock_data = fetch_stock_levels()
+    stock_data = await asyncio.to_thread(fetch_stock_levels)
 
     if not stock_data:
         await update.message.reply_text("No stock data available.")
@@ -2138,7 +2247,7 @@ async def ingredients(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
     await update.message.reply_text(f"⏳ Fetching ingredient usage for {period_display}...")
 
-    usage_data = fetch_ingredient_usage(date_from, date_to)
+    usage_data = await asyncio.to_thread(fetch_ingredient_usage, date_from, date_to)
 
     if not usage_data:
         await update.message.reply_text("No ingredient usage data available.")
@@ -2189,7 +2298,7 @@ async def ingredients(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
     # Generate and send chart
     try:
-        chart = generate_ingredients_chart(used_items, f"Ingredient Usage - {period_display}")
+        chart = await asyncio.to_thread(generate_ingredients_chart, used_items, f"Ingredient Usage - {period_display}")
         if chart:
             await update.message.reply_photo(photo=InputFile(chart, filename='ingredients.png'))
     except Exception as e:
@@ -2199,13 +2308,16 @@ async def ingredients(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 @require_auth
 async def today(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /today command - get today's summary."""
-    today_str = get_business_date().strftime('%Y%m%d')
-    today_display = get_business_date().strftime('%d %b %Y')
+    business_date = get_business_date()
+    today_str = business_date.strftime('%Y%m%d')
+    today_display = business_date.strftime('%d %b %Y')
 
     await update.message.reply_text("⏳ Fetching today's data...")
 
-    transactions = fetch_transactions(today_str)
-    finance_txns = fetch_finance_transactions(today_str)
+    transactions, finance_txns = await asyncio.gather(
+        asyncio.to_thread(fetch_transactions, today_str),
+        asyncio.to_thread(fetch_finance_transactions, today_str),
+    )
 
     active_txns = [t for t in transactions
                    if str(t.get('status', '')) in ('1', '2') and int(t.get('sum', 0) or 0) > 0]
@@ -2228,8 +2340,10 @@ async def week(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     await update.message.reply_text("⏳ Fetching data for this week...")
 
-    transactions = fetch_transactions(date_from, date_to)
-    finance_txns = fetch_finance_transactions(date_from, date_to)
+    transactions, finance_txns = await asyncio.gather(
+        asyncio.to_thread(fetch_transactions, date_from, date_to),
+        asyncio.to_thread(fetch_finance_transactions, date_from, date_to),
+    )
 
     summary_data = calculate_summary(transactions)
     expenses_data = calculate_expenses(finance_txns)
@@ -2258,7 +2372,7 @@ async def week(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     # Generate and send chart
     if transactions:
-        chart = generate_sales_chart(transactions, monday, today_date, f"Weekly Profit & Expenses ({week_display})", finance_txns)
+        chart = await asyncio.to_thread(generate_sales_chart, transactions, monday, today_date, f"Weekly Profit & Expenses ({week_display})", expenses_data['expense_list'])
         await update.message.reply_photo(photo=chart, caption="📊 Daily breakdown")
 
 
@@ -2274,8 +2388,10 @@ async def month(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     await update.message.reply_text(f"⏳ Fetching data for {month_display}...")
 
-    transactions = fetch_transactions(date_from, date_to)
-    finance_txns = fetch_finance_transactions(date_from, date_to)
+    transactions, finance_txns = await asyncio.gather(
+        asyncio.to_thread(fetch_transactions, date_from, date_to),
+        asyncio.to_thread(fetch_finance_transactions, date_from, date_to),
+    )
 
     summary_data = calculate_summary(transactions)
     expenses_data = calculate_expenses(finance_txns)
@@ -2304,7 +2420,7 @@ async def month(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     # Generate and send chart
     if transactions:
-        chart = generate_sales_chart(transactions, first_of_month, today_date, f"Monthly Profit & Expenses ({month_display})", finance_txns)
+        chart = await asyncio.to_thread(generate_sales_chart, transactions, first_of_month, today_date, f"Monthly Profit & Expenses ({month_display})", expenses_data['expense_list'])
         await update.message.reply_photo(photo=chart, caption="📊 Daily breakdown")
 
 
@@ -2356,8 +2472,10 @@ async def summary(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
         await update.message.reply_text(f"⏳ Fetching data for {date_display}...")
 
-        transactions = fetch_transactions(date_from_str, date_to_str)
-        finance_txns = fetch_finance_transactions(date_from_str, date_to_str)
+        transactions, finance_txns = await asyncio.gather(
+            asyncio.to_thread(fetch_transactions, date_from_str, date_to_str),
+            asyncio.to_thread(fetch_finance_transactions, date_from_str, date_to_str),
+        )
 
         summary_data = calculate_summary(transactions)
         expenses_data = calculate_expenses(finance_txns)
@@ -2386,7 +2504,7 @@ async def summary(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
         # Generate and send chart for date range
         if transactions and days_count > 1:
-            chart = generate_sales_chart(transactions, date_from.date(), date_to.date(), f"Profit & Expenses ({date_display})", finance_txns)
+            chart = await asyncio.to_thread(generate_sales_chart, transactions, date_from.date(), date_to.date(), f"Profit & Expenses ({date_display})", expenses_data['expense_list'])
             await update.message.reply_photo(photo=chart, caption="📊 Daily breakdown")
         return
 
@@ -2396,8 +2514,10 @@ async def summary(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     await update.message.reply_text(f"⏳ Fetching data for {date_display}...")
 
-    transactions = fetch_transactions(date_str)
-    finance_txns = fetch_finance_transactions(date_str)
+    transactions, finance_txns = await asyncio.gather(
+        asyncio.to_thread(fetch_transactions, date_str),
+        asyncio.to_thread(fetch_finance_transactions, date_str),
+    )
 
     summary_data = calculate_summary(transactions)
     expenses_data = calculate_expenses(finance_txns)
@@ -2411,7 +2531,7 @@ async def cash(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /cash command - get current cash register status."""
     await update.message.reply_text("⏳ Fetching cash register data...")
 
-    shifts = fetch_cash_shifts()
+    shifts = await asyncio.to_thread(fetch_cash_shifts)
 
     if not shifts:
         await update.message.reply_text("❌ Could not fetch cash register data.")
@@ -2495,7 +2615,7 @@ async def expenses(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     date_from_str = date_from.strftime('%Y%m%d')
     date_to_str = date_to.strftime('%Y%m%d')
 
-    finance_txns = fetch_finance_transactions(date_from_str, date_to_str)
+    finance_txns = await asyncio.to_thread(fetch_finance_transactions, date_from_str, date_to_str)
     expenses_data = calculate_expenses(finance_txns)
 
     if not expenses_data['expense_list']:
@@ -2507,50 +2627,41 @@ async def expenses(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     # Group expenses by category
-    by_category = {}
+    by_category = defaultdict(lambda: {'total': 0, 'items': []})
     for exp in expenses_data['expense_list']:
-        cat = exp['category'] or 'Uncategorized'
-        if cat not in by_category:
-            by_category[cat] = {'total': 0, 'items': []}
-        by_category[cat]['total'] += exp['amount']
-        by_category[cat]['items'].append(exp)
-
-    message = f"💸 <b>Expenses for {date_display}</b>\n\n"
-    message += f"<b>Total:</b> -{format_currency(expenses_data['total_expenses'])}\n\n"
+        entry = by_category[exp['category'] or 'Uncategorized']
+        entry['total'] += exp['amount']
+        entry['items'].append(exp)
+
+    # Collect lines and join once instead of growing one string
+    lines = [
+        f"💸 <b>Expenses for {date_display}</b>",
+        "",
+        f"<b>Total:</b> -{format_currency(expenses_data['total_expenses'])}",
+    ]
 
     for category, data in sorted(by_category.items(), key=lambda x: x[1]['total'], reverse=True):
-        message += f"<b>{category}:</b> {format_currency(data['total'])}\n"
+        lines.append("")
+        lines.append(f"<b>{category}:</b> {format_currency(data['total'])}")
         for item in data['items'][:5]:  # Show top 5 per category
             comment = item['comment'][:30] + '...' if len(item['comment']) > 30 else item['comment']
             if comment:
-                message += f"  • {comment}: {format_currency(item['amount'])}\n"
+                lines.append(f"  • {comment}: {format_currency(item['amount'])}")
             else:
-                message += f"  • {format_currency(item['amount'])}\n"
+                lines.append(f"  • {format_currency(item['amount'])}")
         if len(data['items']) > 5:
-            message += f"  <i>... and {len(data['items']) - 5} more</i>\n"
-        message += "\n"
+            lines.append(f"  <i>... and {len(data['items']) - 5} more</i>")
 
-    await update.message.reply_text(message.strip(), parse_mode=ParseMode.HTML)
+    await update.message.reply_text("\n".join(lines), parse_mode=ParseMode.HTML)
 
 
 def fetch_removed_transactions(date_from, date_to=None):
     """Fetch removed/voided transactions from Poster API."""
-    url = f"{POSTER_API_URL}/dash.getTransactions"
-    params = {
-        "token": config.POSTER_ACCESS_TOKEN,
+    return _poster_get("dash.getTransactions", "removed transactions", {
         "dateFrom": date_from,
         "dateTo": date_to or date_from,
         "status": "3"  # Status 3 = removed/voided
-    }
-
-    try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("response", [])
-    except requests.RequestException as e:
-        logger.error(f"Failed to fetch removed transactions: {e}")
-        return []
+    })
 
 
 @require_auth
@@ -2563,7 +2674,7 @@ async def subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     subscribed_chats.add(chat_id)
-    save_config()
+    save_config_soon()
     await update.message.reply_text(
         "🔔 <b>Subscribed!</b>\n\n"
         "You'll now receive notifications for each new sale.\n"
@@ -2583,7 +2694,7 @@ async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         return
 
     subscribed_chats.discard(chat_id)
-    save_config()
+    save_config_soon()
     await update.message.reply_text(
         "🔕 <b>Unsubscribed!</b>\n\n"
         "You'll no longer receive real-time sale notifications.",
@@ -2602,7 +2713,7 @@ async def alerts_on(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     theft_alert_chats.add(chat_id)
-    save_config()
+    save_config_soon()
     await update.message.reply_text(
         "🚨 <b>Theft Detection Enabled!</b>\n\n"
         "You'll receive alerts for:\n"
@@ -2627,7 +2738,7 @@ async def alerts_off(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         return
 
     theft_alert_chats.discard(chat_id)
-    save_config()
+    save_config_soon()
     await update.message.reply_text(
         "🔕 <b>Theft Detection Disabled!</b>\n\n"
         "You'll no longer receive theft alerts.",
@@ -2641,21 +2752,30 @@ async def send_theft_alert(alert_type, message):
     if not theft_alert_chats or not TELEGRAM_BOT_TOKEN:
         return
 
-    bot = Bot(token=TELEGRAM_BOT_TOKEN)
+    bot = get_bot()
 
-    for chat_id in theft_alert_chats.copy():
-        try:
-            result = await safe_send_message(bot, chat_id, message, parse_mode=ParseMode.HTML)
-            if result is None:
-                logger.warning(f"Failed to send theft alert to {chat_id}")
-        except Conflict:
+    for chat_id, result in await broadcast_message(bot, theft_alert_chats, message):
+        if isinstance(result, Conflict):
             logger.error("Bot conflict detected in send_theft_alert")
-            return  # Stop sending, another instance is running
-        except Exception as e:
-            logger.error(f"Failed to send theft alert to {chat_id}: {e}")
-            if "chat not found" in str(e).lower() or "bot was blocked" in str(e).lower():
+            return  # Another instance is running
+        if isinstance(result, Exception):
+            logger.error(f"Failed to send theft alert to {chat_id}: {result}")
+            if "chat not found" in str(result).lower() or "bot was blocked" in str(result).lower():
                 theft_alert_chats.discard(chat_id)
-                save_config()
+                save_config_soon()
+        elif result is None:
+            logger.warning(f"Failed to send theft alert to {chat_id}")
+
+
+def _pairs_by_transaction_id(rows, reverse=False):
+    """Pair rows with their integer transaction_id, sorted by it.
+
+    Each ID is parsed once and handed back with its row, so the sort and
+    the caller's loop share it instead of each calling int() again.
+    """
+    pairs = [(int(row.get('transaction_id', 0) or 0), row) for row in rows]
+    pairs.sort(key=lambda pair: pair[0], reverse=reverse)
+    return pairs
 
 
 async def check_theft_indicators():
@@ -2668,23 +2788,27 @@ async def check_theft_indicators():
     today_str = get_business_date().strftime('%Y%m%d')
 
     try:
+        # The checks below are independent, so fetch their data concurrently
+        voided, transactions, shifts, finance_txns = await asyncio.gather(
+            asyncio.to_thread(fetch_removed_transactions, today_str),
+            asyncio.to_thread(fetch_transactions, today_str, fresh=True),
+            asyncio.to_thread(fetch_cash_shifts),
+            asyncio.to_thread(fetch_finance_transactions, today_str, fresh=True),
+        )
+
         # Check for voided transactions
-        voided = fetch_removed_transactions(today_str)
         if voided:
-            voided.sort(key=lambda x: int(x.get('transaction_id', 0)), reverse=True)
-            latest_void = voided[0]
-            latest_void_id = latest_void.get('transaction_id')
+            voids = _pairs_by_transaction_id(voided, reverse=True)
+            # Kept as int (also when persisted) so comparisons need no coercion
+            latest_void_id = voids[0][0]
 
             if last_seen_void_id is None:
                 last_seen_void_id = latest_void_id
                 config.last_seen_void_id = last_seen_void_id
-                save_config()
+                save_config_soon()
             elif latest_void_id != last_seen_void_id:
                 # New void detected
-                new_voids = [
-                    v for v in voided
-                    if int(v.get('transaction_id', 0)) > int(last_seen_void_id or 0)
-                ]
+                new_voids = [v for void_id, v in voids if void_id > last_seen_void_id]
                 last_seen_void_id = latest_void_id
 
                 for void_txn in new_voids:
@@ -2704,12 +2828,8 @@ async def check_theft_indicators():
                     await send_theft_alert("void", alert_msg)
 
         # Check for suspicious transactions
-        transactions = fetch_transactions(today_str)
         # Sort by transaction ID ascending to process in order
-        transactions.sort(key=lambda x: int(x.get('transaction_id', 0) or 0))
-        for txn in transactions:
-            txn_id = int(txn.get('transaction_id', 0) or 0)
-
+        for txn_id, txn in _pairs_by_transaction_id(transactions):
             # Skip if we've already checked this transaction
             if txn_id <= last_alerted_transaction_id:
                 continue
@@ -2772,7 +2892,6 @@ async def check_theft_indicators():
             last_alerted_transaction_id = txn_id
 
         # Check cash register discrepancies
-        shifts = fetch_cash_shifts()
         if shifts:
             latest_shift = shifts[0]
             if latest_shift.get('date_end'):  # Shift is closed
@@ -2809,14 +2928,10 @@ async def check_theft_indicators():
                         await send_theft_alert("overage", alert_msg)
 
         # Check for large expenses
-        finance_txns = fetch_finance_transactions(today_str)
         expenses_data = calculate_expenses(finance_txns)
         expense_list = expenses_data['expense_list']
         # Sort by transaction ID ascending to process in order
-        expense_list.sort(key=lambda x: int(x.get('transaction_id', 0) or 0))
-
-        for expense in expense_list:
-            expense_id = int(expense.get('transaction_id', 0) or 0)
+        for expense_id, expense in _pairs_by_transaction_id(expense_list):
             if expense_id <= last_alerted_expense_id:
                 continue
 
@@ -2843,7 +2958,7 @@ async def check_theft_indicators():
         config.last_alerted_transaction_id = last_alerted_transaction_id
         config.last_alerted_expense_id = last_alerted_expense_id
         # Save state after checking to persist alerted items
-        save_config()
+        save_config_soon()
 
     except Exception as e:
         logger.error(f"Error in theft detection: {e}")
@@ -2861,18 +2976,19 @@ async def check_new_transactions():
 
     try:
         # Check for business date rollover — clear the set when the day changes
-        current_business_date = get_business_date().isoformat()
+        business_date = get_business_date()
+        current_business_date = business_date.isoformat()
         if notified_transaction_date != current_business_date:
             notified_transaction_ids = set()
             notified_transaction_date = current_business_date
             config.notified_transaction_ids = notified_transaction_ids
             config.notified_transaction_date = notified_transaction_date
-            save_config()
+            save_config_soon()
             logger.info(f"Business date changed to {current_business_date}, cleared notified set")
 
         # Fetch today's transactions
-        today_str = get_business_date().strftime('%Y%m%d')
-        transactions = fetch_transactions(today_str)
+        today_str = business_date.strftime('%Y%m%d')
+        transactions = await asyncio.to_thread(fetch_transactions, today_str, fresh=True)
 
         if not transactions:
             logger.debug("No transactions found for today")
@@ -2886,11 +3002,11 @@ async def check_new_transactions():
                 if status == '2' and total > 0:
                     notified_transaction_ids.add(str(txn.get('transaction_id', '')))
             config.notified_transaction_ids = notified_transaction_ids
-            save_config()
+            save_config_soon()
             logger.info(f"Seeded notified set with {len(notified_transaction_ids)} existing transactions")
             return
 
-        bot = Bot(token=TELEGRAM_BOT_TOKEN)
+        bot = get_bot()
         notifications_sent = 0
         new_count = 0
 
@@ -2925,7 +3041,7 @@ async def check_new_transactions():
             # Fetch items sold in this transaction
             items_str = ""
             try:
-                products = fetch_transaction_products(txn_id)
+                products = await asyncio.to_thread(fetch_transaction_products, txn_id)
                 if products:
                     items_list = []
                     for p in products:
@@ -2949,22 +3065,20 @@ async def check_new_transactions():
                 f"{items_str}"
             )
 
-            for chat_id in subscribed_chats.copy():
-                try:
-                    result = await safe_send_message(bot, chat_id, message, parse_mode=ParseMode.HTML)
-                    if result is None:
-                        logger.warning(f"Failed to send notification for txn {txn_id} to {chat_id}")
-                    else:
-                        notifications_sent += 1
-                except Conflict:
+            for chat_id, result in await broadcast_message(bot, subscribed_chats, message):
+                if isinstance(result, Conflict):
                     logger.error("Bot conflict detected in check_new_transactions")
                     return  # Stop, another instance is running
-                except Exception as e:
-                    logger.error(f"Failed to send to {chat_id}: {e}")
+                if isinstance(result, Exception):
+                    logger.error(f"Failed to send to {chat_id}: {result}")
                     # Remove invalid chats
-                    if "chat not found" in str(e).lower() or "bot was blocked" in str(e).lower():
+                    if "chat not found" in str(result).lower() or "bot was blocked" in str(result).lower():
                         subscribed_chats.discard(chat_id)
-                        save_config()
+                        save_config_soon()
+                elif result is None:
+                    logger.warning(f"Failed to send notification for txn {txn_id} to {chat_id}")
+                else:
+                    notifications_sent += 1
 
             # Broadcast to WebSocket dashboard clients
             try:
@@ -2985,7 +3099,7 @@ async def check_new_transactions():
             # Mark as notified after successful processing
             notified_transaction_ids.add(txn_id_str)
             config.notified_transaction_ids = notified_transaction_ids
-            save_config()
+            save_config_soon()
 
         if new_count > 0:
             logger.info(f"Sent {notifications_sent} notifications for {new_count} new transactions")
@@ -3004,16 +3118,17 @@ async def send_daily_summary():
         logger.warning("TELEGRAM_CHAT_ID or BOT_TOKEN not set, skipping scheduled summary")
         return
 
-    today_str = get_business_date().strftime('%Y%m%d')
-    today_display = get_business_date().strftime('%d %b %Y')
+    business_date = get_business_date()
+    today_str = business_date.strftime('%Y%m%d')
+    today_display = business_date.strftime('%d %b %Y')
 
-    transactions = fetch_transactions(today_str)
+    transactions = await asyncio.to_thread(fetch_transactions, today_str)
     summary_data = calculate_summary(transactions)
 
     message = f"🌙 <b>End of Day Report</b>\n\n" + format_summary_message(today_display, summary_data)[3:]
 
     try:
-        bot = Bot(token=TELEGRAM_BOT_TOKEN)
+        bot = get_bot()
         result = await safe_send_message(bot, TELEGRAM_CHAT_ID, message, parse_mode=ParseMode.HTML)
         if result:
             logger.info("Daily summary sent successfully")
@@ -3094,7 +3209,7 @@ async def setpassword_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             'approved_at': datetime.now().isoformat(),
         }
     config.approved_users[chat_id]["password_hash"] = f"{salt}${password_hash}"
-    save_config()
+    save_config_soon()
 
     from dashboard import get_dashboard_url
     dashboard_url = get_dashboard_url()
@@ -3132,7 +3247,7 @@ async def setgoal_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         return
 
     config.monthly_goal = int(amount_thb * 100)  # Convert THB to satang
-    save_config()
+    save_config_soon()
 
     await update.message.reply_text(
         f"Monthly goal set to <b>{format_currency(config.monthly_goal)}</b>",
@@ -3142,19 +3257,24 @@ async def setgoal_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
 async def startup(application):
     """Run startup tasks before polling begins."""
+    global _bot
     logger.info("Running startup tasks...")
-    await clear_webhook()
+    _bot = application.bot
+    await clear_webhook(application.bot)
 
     # Start the dashboard web server
     from dashboard import start_dashboard_server
     asyncio.create_task(start_dashboard_server())
 
     # Notify all admins that the bot has restarted
-    for chat_id in config.admin_chat_ids:
-        try:
-            await safe_send_message(application.bot, chat_id, "Bot restarted.")
-        except Exception as e:
-            logger.error(f"Failed to notify admin {chat_id} of restart: {e}")
+    admin_ids = list(config.admin_chat_ids)
+    results = await asyncio.gather(*(
+        safe_send_message(application.bot, chat_id, "Bot restarted.")
+        for chat_id in admin_ids
+    ), return_exceptions=True)
+    for chat_id, result in zip(admin_ids, results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to notify admin {chat_id} of restart: {result}")
 
     logger.info("Startup complete")
 
@@ -3170,6 +3290,9 @@ async def shutdown(application):
 
     if scheduler:
         scheduler.shutdown(wait=False)
+
+    # Write out any config changes still waiting on the save debounce
+    await flush_config()
     logger.info("Shutdown complete")
 
 
@@ -3316,6 +3439,8 @@ async def cli_mode():
             print(f"Unknown command: {cmd}")
             print(f"Available: {', '.join(sorted(commands.keys()))}")
 
+    await flush_config()
+
 
 def main():
     """Start the bot."""
@@ -3368,6 +3493,9 @@ def main():
             connect_timeout=REQUEST_CONNECT_TIMEOUT,
             pool_timeout=REQUEST_POOL_TIMEOUT,
         ))
+        # Handle updates concurrently so a long /agent run doesn't hold up
+        # other users' commands
+        .concurrent_updates(True)
         .post_init(startup)
         .post_shutdown(shutdown)
         .build()
@@ -2,78 +2,74 @@
 Chart generation functions for Ban Sabai POS Bot.
 """
 import io
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 try:
     import matplotlib
     matplotlib.use('Agg')  # Use non-interactive backend
-    import matplotlib.pyplot as plt
+    from matplotlib.figure import Figure
     from matplotlib.ticker import FuncFormatter
     CHARTS_AVAILABLE = True
 except ImportError:
-    plt = None
+    Figure = None
     FuncFormatter = None
     CHARTS_AVAILABLE = False
 
 
-def generate_sales_chart(transactions, date_from, date_to, title, finance_transactions=None):
-    """Generate a bar chart showing daily gross profit, net profit, and expenses."""
+def _format_thousands(value, _pos):
+    """Tick formatter: whole numbers with a thousands separator."""
+    return f'{value:,.0f}'
+
+
+def _render_png(fig):
+    """Lay out a Figure and return it as a PNG BytesIO buffer."""
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=100, bbox_inches='tight')
+    buf.seek(0)
+    return buf
+
+
+def generate_sales_chart(transactions, date_from, date_to, title, expense_list=None):
+    """Generate a bar chart showing daily gross profit, net profit, and expenses.
+
+    expense_list is the 'expense_list' returned by calculate_expenses, so the
+    finance rows are filtered once per report instead of once per consumer.
+    """
     if not CHARTS_AVAILABLE:
         return None
 
-    # Group transactions by date
-    daily_data = {}
+    # Daily totals are kept in flat lists indexed by day offset from date_from.
+    # Days are looked up by their 'YYYY-MM-DD' string, so rows need no parsing.
+    dates = []
     current = date_from
     while current <= date_to:
-        daily_data[current] = {'sales': 0, 'gross_profit': 0, 'expenses': 0}
+        dates.append(current)
         current += timedelta(days=1)
+    day_index = {d.isoformat(): i for i, d in enumerate(dates)}
+    daily_profit = [0] * len(dates)
+    daily_expenses = [0] * len(dates)
 
     for txn in transactions:
         txn_date = (txn.get('date_close_date', '') or txn.get('date', ''))[:10]  # Get YYYY-MM-DD
-        if txn_date:
-            try:
-                d = datetime.strptime(txn_date, '%Y-%m-%d').date()
-                if d in daily_data:
-                    daily_data[d]['sales'] += int(txn.get('sum', 0) or 0)
-                    daily_data[d]['gross_profit'] += int(txn.get('total_profit', 0) or 0)
-            except ValueError:
-                continue
-
-    # Process expenses by date
-    if finance_transactions:
-        for txn in finance_transactions:
-            amount = int(txn.get('amount', 0) or 0)
-            comment = txn.get('comment', '')
-
-            category = txn.get('category_name', '')
-
-            # Skip cash payments (sales income)
-            if 'Cash payments' in comment:
-                continue
-
-            # Skip transfers and adjustments (cash moving to safe, not real expenses)
-            if category in ('Transfers', 'Adjustment'):
-                continue
-
-            # Only count expenses (negative amounts)
-            if amount < 0:
-                txn_date = txn.get('date', '')[:10]
-                if txn_date:
-                    try:
-                        d = datetime.strptime(txn_date, '%Y-%m-%d').date()
-                        if d in daily_data:
-                            daily_data[d]['expenses'] += abs(amount)
-                    except ValueError:
-                        continue
-
-    # Prepare data for plotting
-    dates = sorted(daily_data.keys())
-    gross_profits = [daily_data[d]['gross_profit'] / 100 for d in dates]  # Convert to THB
-    expenses = [-(daily_data[d]['expenses'] / 100) for d in dates]  # Negative for display
-    net_profits = [(daily_data[d]['gross_profit'] - daily_data[d]['expenses']) / 100 for d in dates]
+        i = day_index.get(txn_date)
+        if i is not None:
+            daily_profit[i] += int(txn.get('total_profit', 0) or 0)
+
+    # Expenses arrive pre-filtered from calculate_expenses (positive amounts)
+    for expense in expense_list or ():
+        i = day_index.get(expense['date'][:10])
+        if i is not None:
+            daily_expenses[i] += expense['amount']
+
+    # Prepare data for plotting (dates are already in order)
+    gross_profits = [p / 100 for p in daily_profit]  # Convert to THB
+    expenses = [-(e / 100) for e in daily_expenses]  # Negative for display
+    net_profits = [(p - e) / 100 for p, e in zip(daily_profit, daily_expenses)]
 
     # Create chart
-    fig, ax = plt.subplots(figsize=(10, 5))
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
     x = range(len(dates))
     width = 0.27
 
@@ -94,17 +90,9 @@ def generate_sales_chart(transactions, date_from, date_to, title, finance_transa
     ax.grid(axis='y', alpha=0.3)
 
     # Format y-axis with thousands separator
-    ax.yaxis.set_major_formatter(FuncFormatter(lambda x, _: f'{x:,.0f}'))
+    ax.yaxis.set_major_formatter(FuncFormatter(_format_thousands))
 
-    plt.tight_layout()
-
-    # Save to BytesIO
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-    buf.seek(0)
-    plt.close(fig)
-
-    return buf
+    return _render_png(fig)
 
 
 def generate_products_chart(product_sales, title, top_n=10):
@@ -120,7 +108,8 @@ def generate_products_chart(product_sales, title, top_n=10):
     revenues = [int(p.get('payed_sum', 0) or 0) / 100 for p in sorted_products]
     profits = [int(p.get('product_profit', 0) or 0) / 100 for p in sorted_products]
 
-    fig, ax = plt.subplots(figsize=(10, 6))
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
     y = range(len(names))
     height = 0.35
 
@@ -133,16 +122,9 @@ def generate_products_chart(product_sales, title, top_n=10):
     ax.set_yticklabels(names)
     ax.legend()
     ax.grid(axis='x', alpha=0.3)
-    ax.xaxis.set_major_formatter(FuncFormatter(lambda x, _: f'{x:,.0f}'))
+    ax.xaxis.set_major_formatter(FuncFormatter(_format_thousands))
 
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-    buf.seek(0)
-    plt.close(fig)
-
-    return buf
+    return _render_png(fig)
 
 
 def generate_ingredients_chart(usage_data, title, top_n=15):
@@ -158,7 +140,8 @@ def generate_ingredients_chart(usage_data, title, top_n=15):
     names = [item.get('ingredient_name', 'Unknown')[:25] for item in sorted_items]
     usage = [float(item.get('write_offs', 0)) for item in sorted_items]
 
-    fig, ax = plt.subplots(figsize=(10, 6))
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
     y = range(len(names))
 
     ax.barh(y, usage, color='#FF9800')
@@ -169,14 +152,7 @@ def generate_ingredients_chart(usage_data, title, top_n=15):
     ax.set_yticklabels(names)
     ax.grid(axis='x', alpha=0.3)
 
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-    buf.seek(0)
-    plt.close(fig)
-
-    return buf
+    return _render_png(fig)
 
 
 def generate_generic_chart(chart_type, labels, data=None, series=None, title=None, x_label=None, y_label=None):
@@ -192,6 +168,9 @@ def generate_generic_chart(chart_type, labels, data=None, series=None, title=Non
 
     Returns:
         BytesIO buffer with PNG image, or None if charts unavailable
+
+    Uses a standalone Figure rather than pyplot, so it keeps no global
+    state and is safe to call from several worker threads at once.
     """
     if not CHARTS_AVAILABLE:
         return None
@@ -206,19 +185,18 @@ def generate_generic_chart(chart_type, labels, data=None, series=None, title=Non
     # Color palette for multiple series
     colors = ['#2196F3', '#4CAF50', '#FF9800', '#F44336', '#9C27B0', '#00BCD4', '#795548', '#607D8B']
 
-    fig, ax = plt.subplots(figsize=(10, 6))
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
 
     if chart_type == "pie":
         # Pie chart - single series only
         values = data if data else (series[0]['data'] if series else [])
         if not values:
-            plt.close(fig)
             return None
 
         # Filter out zero/negative values for pie chart
         filtered = [(l, v) for l, v in zip(labels, values) if v > 0]
         if not filtered:
-            plt.close(fig)
             return None
 
         pie_labels, pie_values = zip(*filtered)
@@ -252,7 +230,7 @@ def generate_generic_chart(chart_type, labels, data=None, series=None, title=Non
         if x_label:
             ax.set_xlabel(x_label)
         ax.grid(axis='x', alpha=0.3)
-        ax.xaxis.set_major_formatter(FuncFormatter(lambda x, _: f'{x:,.0f}'))
+        ax.xaxis.set_major_formatter(FuncFormatter(_format_thousands))
 
     elif chart_type == "line":
         # Line chart
@@ -275,7 +253,7 @@ def generate_generic_chart(chart_type, labels, data=None, series=None, title=Non
         if y_label:
             ax.set_ylabel(y_label)
         ax.grid(alpha=0.3)
-        ax.yaxis.set_major_formatter(FuncFormatter(lambda x, _: f'{x:,.0f}'))
+        ax.yaxis.set_major_formatter(FuncFormatter(_format_thousands))
 
     else:  # bar (vertical)
         x_pos = range(len(labels))
@@ -299,19 +277,12 @@ def generate_generic_chart(chart_type, labels, data=None, series=None, title=Non
         if y_label:
             ax.set_ylabel(y_label)
         ax.grid(axis='y', alpha=0.3)
-        ax.yaxis.set_major_formatter(FuncFormatter(lambda x, _: f'{x:,.0f}'))
+        ax.yaxis.set_major_formatter(FuncFormatter(_format_thousands))
 
     if title:
         ax.set_title(title)
 
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-    buf.seek(0)
-    plt.close(fig)
-
-    return buf
+    return _render_png(fig)
 
 
 def generate_stats_chart(current_sales, prev_sales, title, current_label, prev_label):
@@ -336,7 +307,8 @@ def generate_stats_chart(current_sales, prev_sales, title, current_label, prev_l
         prev_p = prev_lookup.get(name, {})
         prev_values.append(int(prev_p.get('payed_sum', 0) or 0) / 100)
 
-    fig, ax = plt.subplots(figsize=(10, 5))
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
     x = range(len(names))
     width = 0.35
 
@@ -349,13 +321,6 @@ def generate_stats_chart(current_sales, prev_sales, title, current_label, prev_l
     ax.set_xticklabels(names, rotation=45, ha='right')
     ax.legend()
     ax.grid(axis='y', alpha=0.3)
-    ax.yaxis.set_major_formatter(FuncFormatter(lambda x, _: f'{x:,.0f}'))
-
-    plt.tight_layout()
+    ax.yaxis.set_major_formatter(FuncFormatter(_format_thousands))
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-    buf.seek(0)
-    plt.close(fig)
-
-    return buf
+    return _render_png(fig)
@@ -4,19 +4,55 @@ Handles loading, saving, and managing bot state.
 """
 import os
 import json
+import mmap
+import asyncio
 import logging
+import threading
+
+try:
+    import orjson
+
+    def _dumpb(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+
+    _loads = orjson.loads
+    # orjson parses straight from a memoryview, without copying the buffer
+    _loads_view = orjson.loads
+except ImportError:
+    def _dumpb(obj) -> bytes:
+        return json.dumps(obj, indent=2).encode()
+
+    _loads = json.loads
+
+    def _loads_view(view):
+        return json.loads(bytes(view))
 
 logger = logging.getLogger(__name__)
 
 # Config file path
 CONFIG_FILE = os.environ.get('CONFIG_FILE', 'bot_config.json')
 
+# Config files at least this large are memory-mapped instead of read
+CONFIG_MMAP_THRESHOLD = 1 << 20
+
+# Serializes read-modify-write cycles on the config file, which may run in
+# a worker thread (deferred saves) and on the event loop at the same time
+_config_file_lock = threading.RLock()
+
+# Deferred saves: changes within this many seconds are written together
+CONFIG_SAVE_DELAY = 0.5
+_save_task = None
+_save_pending = False
+
 # API Keys (can be set via env vars or config file)
 ANTHROPIC_API_KEY = os.environ.get('ANTHROPIC_API_KEY')
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 ELEVENLABS_API_KEY = os.environ.get('ELEVENLABS_API_KEY')
 POSTER_ACCESS_TOKEN = os.environ.get('POSTER_ACCESS_TOKEN')
 
+# Names of the keys above that can be set via /config, in display order
+API_KEY_VARS = ("ANTHROPIC_API_KEY", "OPENAI_API_KEY", "ELEVENLABS_API_KEY", "POSTER_ACCESS_TOKEN")
+
 # Logging configuration
 LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
 
@@ -172,17 +208,10 @@ def set_log_level(level: str) -> bool:
     LOG_LEVEL = level
 
     # Persist to config file
-    config_data = {}
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r') as f:
-                config_data = json.load(f)
-        except Exception:
-            pass
-
-    config_data['LOG_LEVEL'] = level
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config_data, f, indent=2)
+    with _config_file_lock:
+        config_data = get_config_data()
+        config_data['LOG_LEVEL'] = level
+        write_config_file(config_data)
 
     logger.info(f"Log level set to {level}")
     return True
@@ -195,6 +224,30 @@ def mask_api_key(key: str) -> str:
     return f"{key[:4]}...{key[-4:]}"
 
 
+def _read_config_file() -> dict:
+    """Read and parse the config file; raises if it is missing or invalid."""
+    with open(CONFIG_FILE, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < CONFIG_MMAP_THRESHOLD:
+            return _loads(f.read())
+        # Large file: parse from the page cache without a read() copy
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                return _loads_view(view)
+
+
+def write_config_file(data: dict):
+    """Write the config file atomically.
+
+    The data goes to a temporary file that then replaces the config, so a
+    crash mid-write never leaves a truncated config behind.
+    """
+    tmp_path = f"{CONFIG_FILE}.tmp"
+    with _config_file_lock:
+        with open(tmp_path, 'wb') as f:
+            f.write(_dumpb(data))
+        os.replace(tmp_path, CONFIG_FILE)
+
+
 def load_config():
     """Load persisted state from config file."""
     global notified_transaction_ids, notified_transaction_date, last_seen_void_id, last_cash_balance
@@ -202,129 +255,153 @@ def load_config():
 
     try:
         if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r') as f:
-                cfg = json.load(f)
-                # Update sets/dicts in place so imported references see changes
-                # Convert all chat IDs to strings for consistent comparison
-                subscribed_chats.clear()
-                subscribed_chats.update(str(x) for x in cfg.get('subscribed_chats', []))
-
-                theft_alert_chats.clear()
-                theft_alert_chats.update(str(x) for x in cfg.get('theft_alert_chats', []))
-
-                # Handle both old single admin and new multiple admins format
-                admin_chat_ids.clear()
-                admin_chat_ids.update(str(x) for x in cfg.get('admin_chat_ids', []))
-                # Backwards compatibility: migrate old admin_chat_id to new format
-                old_admin = cfg.get('admin_chat_id')
-                if old_admin and str(old_admin) not in admin_chat_ids:
-                    admin_chat_ids.add(str(old_admin))
-
-                # Ensure approved_users keys are strings
-                approved_users.clear()
-                approved_users.update({str(k): v for k, v in cfg.get('approved_users', {}).items()})
-
-                pending_requests.clear()
-                pending_requests.update({str(k): v for k, v in cfg.get('pending_requests', {}).items()})
-
-                # Load theft detection state
-                notified_transaction_ids = set(cfg.get('notified_transaction_ids', []))
-                notified_transaction_date = cfg.get('notified_transaction_date')
-                last_seen_void_id = cfg.get('last_seen_void_id')
-                last_cash_balance = cfg.get('last_cash_balance')
-
-                global last_alerted_transaction_id, last_alerted_expense_id
-                last_alerted_transaction_id = cfg.get('last_alerted_transaction_id', 0)
-                last_alerted_expense_id = cfg.get('last_alerted_expense_id', 0)
-
-                monthly_goal = cfg.get('monthly_goal', 0)
-
-                # Load API keys (config file overrides env vars)
-                if cfg.get('ANTHROPIC_API_KEY'):
-                    ANTHROPIC_API_KEY = cfg.get('ANTHROPIC_API_KEY')
-                if cfg.get('OPENAI_API_KEY'):
-                    OPENAI_API_KEY = cfg.get('OPENAI_API_KEY')
-                if cfg.get('ELEVENLABS_API_KEY'):
-                    ELEVENLABS_API_KEY = cfg.get('ELEVENLABS_API_KEY')
-                if cfg.get('POSTER_ACCESS_TOKEN'):
-                    POSTER_ACCESS_TOKEN = cfg.get('POSTER_ACCESS_TOKEN')
-
-                # Load log level (config file overrides env var)
-                if cfg.get('LOG_LEVEL'):
-                    LOG_LEVEL = cfg.get('LOG_LEVEL').upper()
-
-                logger.info(f"Loaded config: {len(subscribed_chats)} subscribed, {len(theft_alert_chats)} alert chats, {len(admin_chat_ids)} admins")
-                logger.info(f"Loaded theft state: last_txn_id={last_alerted_transaction_id}, last_expense_id={last_alerted_expense_id}")
+            cfg = _read_config_file()
+            # Update sets/dicts in place so imported references see changes
+            # Convert all chat IDs to strings for consistent comparison
+            subscribed_chats.clear()
+            subscribed_chats.update(str(x) for x in cfg.get('subscribed_chats', []))
+
+            theft_alert_chats.clear()
+            theft_alert_chats.update(str(x) for x in cfg.get('theft_alert_chats', []))
+
+            # Handle both old single admin and new multiple admins format
+            admin_chat_ids.clear()
+            admin_chat_ids.update(str(x) for x in cfg.get('admin_chat_ids', []))
+            # Backwards compatibility: migrate old admin_chat_id to new format
+            old_admin = cfg.get('admin_chat_id')
+            if old_admin and str(old_admin) not in admin_chat_ids:
+                admin_chat_ids.add(str(old_admin))
+
+            # Ensure approved_users keys are strings
+            approved_users.clear()
+            approved_users.update({str(k): v for k, v in cfg.get('approved_users', {}).items()})
+
+            pending_requests.clear()
+            pending_requests.update({str(k): v for k, v in cfg.get('pending_requests', {}).items()})
+
+            # Load theft detection state
+            notified_transaction_ids = set(cfg.get('notified_transaction_ids', []))
+            notified_transaction_date = cfg.get('notified_transaction_date')
+            # Older configs stored the void ID as a string
+            last_seen_void_id = int(cfg['last_seen_void_id']) if cfg.get('last_seen_void_id') else None
+            last_cash_balance = cfg.get('last_cash_balance')
+
+            global last_alerted_transaction_id, last_alerted_expense_id
+            last_alerted_transaction_id = cfg.get('last_alerted_transaction_id', 0)
+            last_alerted_expense_id = cfg.get('last_alerted_expense_id', 0)
+
+            monthly_goal = cfg.get('monthly_goal', 0)
+
+            # Load API keys (config file overrides env vars)
+            if cfg.get('ANTHROPIC_API_KEY'):
+                ANTHROPIC_API_KEY = cfg.get('ANTHROPIC_API_KEY')
+            if cfg.get('OPENAI_API_KEY'):
+                OPENAI_API_KEY = cfg.get('OPENAI_API_KEY')
+            if cfg.get('ELEVENLABS_API_KEY'):
+                ELEVENLABS_API_KEY = cfg.get('ELEVENLABS_API_KEY')
+            if cfg.get('POSTER_ACCESS_TOKEN'):
+                POSTER_ACCESS_TOKEN = cfg.get('POSTER_ACCESS_TOKEN')
+
+            # Load log level (config file overrides env var)
+            if cfg.get('LOG_LEVEL'):
+                LOG_LEVEL = cfg.get('LOG_LEVEL').upper()
+
+            logger.info(f"Loaded config: {len(subscribed_chats)} subscribed, {len(theft_alert_chats)} alert chats, {len(admin_chat_ids)} admins")
+            logger.info(f"Loaded theft state: last_txn_id={last_alerted_transaction_id}, last_expense_id={last_alerted_expense_id}")
     except Exception as e:
         logger.error(f"Failed to load config: {e}")
 
 
-def save_config():
-    """Save state to config file."""
+def _config_state() -> dict:
+    """Snapshot the persisted in-memory state."""
+    return {
+        'subscribed_chats': list(subscribed_chats),
+        'theft_alert_chats': list(theft_alert_chats),
+        'admin_chat_ids': list(admin_chat_ids),
+        'approved_users': dict(approved_users),
+        'pending_requests': dict(pending_requests),
+        # Theft detection state
+        'notified_transaction_ids': list(notified_transaction_ids),
+        'notified_transaction_date': notified_transaction_date,
+        'last_seen_void_id': last_seen_void_id,
+        'last_cash_balance': last_cash_balance,
+        'last_alerted_transaction_id': last_alerted_transaction_id,
+        'last_alerted_expense_id': last_alerted_expense_id,
+        'monthly_goal': monthly_goal
+    }
+
+
+def _write_config_state(config: dict):
+    """Write a state snapshot, keeping the API keys stored in the file."""
     try:
-        # Read existing config to preserve API keys
-        existing_config = {}
-        if os.path.exists(CONFIG_FILE):
-            try:
-                with open(CONFIG_FILE, 'r') as f:
-                    existing_config = json.load(f)
-            except Exception:
-                pass
-
-        config = {
-            'subscribed_chats': list(subscribed_chats),
-            'theft_alert_chats': list(theft_alert_chats),
-            'admin_chat_ids': list(admin_chat_ids),
-            'approved_users': approved_users,
-            'pending_requests': pending_requests,
-            # Theft detection state
-            'notified_transaction_ids': list(notified_transaction_ids),
-            'notified_transaction_date': notified_transaction_date,
-            'last_seen_void_id': last_seen_void_id,
-            'last_cash_balance': last_cash_balance,
-            'last_alerted_transaction_id': last_alerted_transaction_id,
-            'last_alerted_expense_id': last_alerted_expense_id,
-            'monthly_goal': monthly_goal
-        }
-        # Preserve API keys and log level from existing config
-        if existing_config.get('ANTHROPIC_API_KEY'):
-            config['ANTHROPIC_API_KEY'] = existing_config['ANTHROPIC_API_KEY']
-        if existing_config.get('OPENAI_API_KEY'):
-            config['OPENAI_API_KEY'] = existing_config['OPENAI_API_KEY']
-        if existing_config.get('ELEVENLABS_API_KEY'):
-            config['ELEVENLABS_API_KEY'] = existing_config['ELEVENLABS_API_KEY']
-        if existing_config.get('POSTER_ACCESS_TOKEN'):
-            config['POSTER_ACCESS_TOKEN'] = existing_config['POSTER_ACCESS_TOKEN']
-        if existing_config.get('LOG_LEVEL'):
-            config['LOG_LEVEL'] = existing_config['LOG_LEVEL']
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=2)
+        with _config_file_lock:
+            # Read existing config to preserve API keys
+            existing_config = get_config_data()
+
+            # Preserve API keys and log level from existing config
+            for key_name in (*API_KEY_VARS, 'LOG_LEVEL'):
+                if existing_config.get(key_name):
+                    config[key_name] = existing_config[key_name]
+            write_config_file(config)
         logger.debug("Config saved")
     except Exception as e:
         logger.error(f"Failed to save config: {e}")
 
 
+def save_config():
+    """Save state to config file."""
+    _write_config_state(_config_state())
+
+
+def save_config_soon():
+    """Schedule a state save, coalescing bursts of changes into one write.
+
+    The snapshot is taken on the event loop and written from a worker
+    thread, so handlers never block on disk I/O. Outside an event loop
+    this saves immediately.
+    """
+    global _save_task, _save_pending
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        save_config()
+        return
+
+    _save_pending = True
+    if _save_task is None:
+        _save_task = asyncio.create_task(_config_writer())
+
+
+async def _config_writer():
+    """Write pending state until no more changes arrive."""
+    global _save_task, _save_pending
+    try:
+        while _save_pending:
+            await asyncio.sleep(CONFIG_SAVE_DELAY)
+            _save_pending = False
+            await asyncio.to_thread(_write_config_state, _config_state())
+    finally:
+        _save_task = None
+
+
+async def flush_config():
+    """Wait for any scheduled state save to be written."""
+    if _save_task is not None:
+        await _save_task
+
+
 def set_api_key(var_name: str, value: str) -> bool:
     """Set an API key in config file and memory."""
     global ANTHROPIC_API_KEY, OPENAI_API_KEY, ELEVENLABS_API_KEY, POSTER_ACCESS_TOKEN
 
-    allowed_vars = ["ANTHROPIC_API_KEY", "OPENAI_API_KEY", "ELEVENLABS_API_KEY", "POSTER_ACCESS_TOKEN"]
-    if var_name not in allowed_vars:
+    if var_name not in API_KEY_VARS:
         return False
 
-    # Load existing config
-    config_data = {}
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r') as f:
-                config_data = json.load(f)
-        except Exception:
-            pass
-
-    # Update the variable
-    config_data[var_name] = value
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config_data, f, indent=2)
+    # Load existing config and update the variable
+    with _config_file_lock:
+        config_data = get_config_data()
+        config_data[var_name] = value
+        write_config_file(config_data)
 
     # Update global variable
     if var_name == "ANTHROPIC_API_KEY":
@@ -344,47 +421,54 @@ def delete_api_key(var_name: str) -> bool:
     """Delete an API key from config file and memory."""
     global ANTHROPIC_API_KEY, OPENAI_API_KEY, ELEVENLABS_API_KEY, POSTER_ACCESS_TOKEN
 
-    allowed_vars = ["ANTHROPIC_API_KEY", "OPENAI_API_KEY", "ELEVENLABS_API_KEY", "POSTER_ACCESS_TOKEN"]
-    if var_name not in allowed_vars:
+    if var_name not in API_KEY_VARS:
         return False
 
-    # Load existing config
-    config_data = {}
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r') as f:
-                config_data = json.load(f)
-        except Exception:
-            pass
-
-    # Delete the variable if it exists
-    if var_name in config_data:
+    # Load existing config and delete the variable if it exists
+    with _config_file_lock:
+        config_data = get_config_data()
+        if var_name not in config_data:
+            return False
         del config_data[var_name]
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config_data, f, indent=2)
+        write_config_file(config_data)
+
+    # Clear global variable
+    if var_name == "ANTHROPIC_API_KEY":
+        ANTHROPIC_API_KEY = None
+    elif var_name == "OPENAI_API_KEY":
+        OPENAI_API_KEY = None
+    elif var_name == "ELEVENLABS_API_KEY":
+        ELEVENLABS_API_KEY = None
+    elif var_name == "POSTER_ACCESS_TOKEN":
+        POSTER_ACCESS_TOKEN = None
+
+    logger.info(f"Config variable {var_name} deleted")
+    return True
 
-        # Clear global variable
-        if var_name == "ANTHROPIC_API_KEY":
-            ANTHROPIC_API_KEY = None
-        elif var_name == "OPENAI_API_KEY":
-            OPENAI_API_KEY = None
-        elif var_name == "ELEVENLABS_API_KEY":
-            ELEVENLABS_API_KEY = None
-        elif var_name == "POSTER_ACCESS_TOKEN":
-            POSTER_ACCESS_TOKEN = None
 
-        logger.info(f"Config variable {var_name} deleted")
-        return True
+def get_config_snapshot() -> dict:
+    """Get the config as it is (or is about to be) saved, built from memory.
 
-    return False
+    Same layout as the config file, without touching the disk; also
+    reflects changes still waiting on the save debounce.
+    """
+    snapshot = _config_state()
+    api_keys = {
+        'ANTHROPIC_API_KEY': ANTHROPIC_API_KEY,
+        'OPENAI_API_KEY': OPENAI_API_KEY,
+        'ELEVENLABS_API_KEY': ELEVENLABS_API_KEY,
+        'POSTER_ACCESS_TOKEN': POSTER_ACCESS_TOKEN,
+    }
+    snapshot.update((k, v) for k, v in api_keys.items() if v)
+    snapshot['LOG_LEVEL'] = LOG_LEVEL
+    return snapshot
 
 
 def get_config_data() -> dict:
     """Get the current config file data."""
     if os.path.exists(CONFIG_FILE):
         try:
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
+            return _read_config_file()
         except Exception:
             pass
     return {}
@@ -445,6 +445,15 @@ def _build_cash_timeline(transactions, finance_txns, shifts):
     }
 
 
+def _parse_close_hour(close_date):
+    """Parse the date and hour of a 'YYYY-MM-DD HH:MM:SS' timestamp.
+
+    Slices the fixed-width fields instead of running strptime per row;
+    invalid dates or hours still raise ValueError.
+    """
+    return datetime(int(close_date[:4]), int(close_date[5:7]), int(close_date[8:10]), int(close_date[11:13]))
+
+
 def _build_hourly_by_weekday(transactions):
     """Group transactions by day-of-week and hour for Chart.js."""
     from app import adjust_poster_time
@@ -456,7 +465,7 @@ def _build_hourly_by_weekday(transactions):
         close_date = adjust_poster_time(txn.get('date_close_date', '') or txn.get('date', ''))
         if ' ' in close_date:
             try:
-                dt = datetime.strptime(close_date, "%Y-%m-%d %H:%M:%S")
+                dt = _parse_close_hour(close_date)
                 day_name = day_names[dt.weekday()]
                 hour = dt.hour
                 data[day_name][hour]["sales"] += int(txn.get('sum', 0) or 0)
@@ -513,7 +522,7 @@ def _build_hourly_average(transactions):
         close_date = adjust_poster_time(txn.get('date_close_date', '') or txn.get('date', ''))
         if ' ' in close_date:
             try:
-                dt = datetime.strptime(close_date, "%Y-%m-%d %H:%M:%S")
+                dt = _parse_close_hour(close_date)
                 unique_days.add(dt.date())
                 hour = dt.hour
                 hourly[hour]["sales"] += int(txn.get('sum', 0) or 0)
@@ -586,8 +595,10 @@ async def api_summary(period: str, session: dict = Depends(require_auth)):
         raise HTTPException(status_code=400, detail="Invalid period")
 
     date_from, date_to, display = _get_date_range(period)
-    transactions = await _run_sync(fetch_transactions, date_from, date_to)
-    finance_txns = await _run_sync(fetch_finance_transactions, date_from, date_to)
+    transactions, finance_txns = await asyncio.gather(
+        _run_sync(fetch_transactions, date_from, date_to),
+        _run_sync(fetch_finance_transactions, date_from, date_to),
+    )
 
     closed = _filter_closed_sales(transactions)
     summary = calculate_summary(closed)
@@ -620,8 +631,10 @@ async def api_summary_custom(
     """Return summary for a custom date range."""
     from app import fetch_transactions, fetch_finance_transactions, calculate_summary, calculate_expenses
 
-    transactions = await _run_sync(fetch_transactions, date_from, date_to)
-    finance_txns = await _run_sync(fetch_finance_transactions, date_from, date_to)
+    transactions, finance_txns = await asyncio.gather(
+        _run_sync(fetch_transactions, date_from, date_to),
+        _run_sync(fetch_finance_transactions, date_from, date_to),
+    )
 
     closed = _filter_closed_sales(transactions)
     summary = calculate_summary(closed)
@@ -734,14 +747,16 @@ async def page_dashboard(request: Request):
     from app import fetch_transactions, fetch_finance_transactions, fetch_cash_shifts, get_business_date, adjust_poster_time, calculate_summary, format_currency
 
     today_str = get_business_date().strftime('%Y%m%d')
-    transactions = await _run_sync(fetch_transactions, today_str)
-    finance_txns = await _run_sync(fetch_finance_transactions, today_str)
+    transactions, finance_txns, shifts = await asyncio.gather(
+        _run_sync(fetch_transactions, today_str),
+        _run_sync(fetch_finance_transactions, today_str),
+        _run_sync(fetch_cash_shifts),
+    )
     closed = _filter_closed_sales(transactions)
     closed.sort(key=lambda x: int(x.get('transaction_id', 0) or 0), reverse=True)
     summary = calculate_summary(closed)
 
-    # Fetch cash register status
-    shifts = await _run_sync(fetch_cash_shifts)
+    # Cash register status
     cash_register = None
     if shifts:
         latest = shifts[0]
@@ -885,8 +900,11 @@ async def page_summary(
     if period != "custom":
         date_from_api, date_to_api, display = _get_date_range(period)
 
-    transactions = await _run_sync(fetch_transactions, date_from_api, date_to_api)
-    finance_txns = await _run_sync(fetch_finance_transactions, date_from_api, date_to_api)
+    transactions, finance_txns, shifts = await asyncio.gather(
+        _run_sync(fetch_transactions, date_from_api, date_to_api),
+        _run_sync(fetch_finance_transactions, date_from_api, date_to_api),
+        _run_sync(fetch_cash_shifts),
+    )
 
     closed = _filter_closed_sales(transactions)
     summary = calculate_summary(closed)
@@ -910,7 +928,6 @@ async def page_summary(
             pct = (day_profit / daily_target * 100) if daily_target > 0 else 0
             daily_goal_pct["values"].append(round(pct, 1))
 
-    shifts = await _run_sync(fetch_cash_shifts)
     cash_timeline = _build_cash_timeline(closed, finance_txns, shifts)
 
     # Build expense-by-comment pie chart data with fuzzy label merging
@@ -1081,8 +1098,10 @@ async def page_products(request: Request, period: str = "month"):
         period = "today"
 
     date_from, date_to, display = _get_date_range(period)
-    products_raw = await _run_sync(fetch_product_sales, date_from, date_to)
-    catalog = await _run_sync(fetch_product_catalog)
+    products_raw, catalog = await asyncio.gather(
+        _run_sync(fetch_product_sales, date_from, date_to),
+        _run_sync(fetch_product_catalog),
+    )
 
     # Process and sort
     product_list = []
@@ -1255,8 +1274,7 @@ async def api_config_save(body: ConfigUpdateRequest, session: dict = Depends(req
                     entry["password_hash"] = real_entry["password_hash"]
 
     # Write merged config
-    with open(config.CONFIG_FILE, 'w') as f:
-        json.dump(submitted, f, indent=2)
+    config.write_config_file(submitted)
 
     # Refresh in-memory state
     config.load_config()
@@ -1317,10 +1335,12 @@ async def page_alerts(
         date_from_api, date_to_api, display = _get_date_range(period)
 
     # Fetch all data sources in parallel
-    removed = await _run_sync(fetch_removed_transactions, date_from_api, date_to_api)
-    transactions = await _run_sync(fetch_transactions, date_from_api, date_to_api)
-    finance_txns = await _run_sync(fetch_finance_transactions, date_from_api, date_to_api)
-    shifts = await _run_sync(fetch_cash_shifts)
+    removed, transactions, finance_txns, shifts = await asyncio.gather(
+        _run_sync(fetch_removed_transactions, date_from_api, date_to_api),
+        _run_sync(fetch_transactions, date_from_api, date_to_api),
+        _run_sync(fetch_finance_transactions, date_from_api, date_to_api),
+        _run_sync(fetch_cash_shifts),
+    )
 
     # --- 1. Voided transactions ---
     void_list = []
@@ -1652,8 +1672,10 @@ async def page_customers(
         date_from_api, date_to_api, display = _get_date_range(period)
 
     # Fetch transactions and client list in parallel
-    transactions = await _run_sync(fetch_transactions, date_from_api, date_to_api)
-    clients = await _run_sync(fetch_clients)
+    transactions, clients = await asyncio.gather(
+        _run_sync(fetch_transactions, date_from_api, date_to_api),
+        _run_sync(fetch_clients),
+    )
 
     # Build client name lookup from clients API
     client_names = {}
@@ -1825,8 +1847,10 @@ async def page_transactions(
     if period != "custom":
         date_from_api, date_to_api, display = _get_date_range(period)
 
-    transactions = await _run_sync(fetch_transactions, date_from_api, date_to_api)
-    clients = await _run_sync(fetch_clients)
+    transactions, clients = await asyncio.gather(
+        _run_sync(fetch_transactions, date_from_api, date_to_api),
+        _run_sync(fetch_clients),
+    )
 
     # Build client name lookup
     client_names = {}
@@ -2090,11 +2114,12 @@ async def api_chat(body: ChatRequest, session: dict = Depends(require_auth)):
 
         config.agent_conversations[user_id] = updated_history
 
-        # Encode charts as base64 data URIs
+        # Encode charts as base64 data URIs, straight from each BytesIO's
+        # buffer (getbuffer) instead of read()ing a copy of the PNG first
         chart_images = []
         for chart_buf in charts:
-            chart_buf.seek(0)
-            b64 = base64.b64encode(chart_buf.read()).decode('utf-8')
+            with chart_buf.getbuffer() as png:
+                b64 = base64.b64encode(png).decode('ascii')
             chart_images.append(f"data:image/png;base64,{b64}")
 
         logger.info(f"Agent response: {len(chart_images)} charts, {len(render_panels)} render_panels")